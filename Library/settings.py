@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'catalog.profiling.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,7 +64,7 @@ ROOT_URLCONF = 'Library.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'catalog.profiling.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')]
         ,
         'APP_DIRS': True,
@@ -143,8 +144,65 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = ''
 EMAIL_HOST_PASSWORD = ''
 
+# Sender of the catalog email, and how the send_queued_email worker retries a
+# failed delivery: the delay in seconds doubles after every attempt.
+CATALOG_EMAIL_SENDER = 'sender smtp gmail<dolphin2016water@gmail.com>'
+CATALOG_EMAIL_MAX_ATTEMPTS = 5
+CATALOG_EMAIL_RETRY_DELAY = 60
+
+# 'link' emails an expiring download link to the book PDF, 'attachment' attaches
+# the PDF itself. Links stay valid for CATALOG_DOWNLOAD_LINK_MAX_AGE seconds.
+CATALOG_EMAIL_DELIVERY = 'link'
+CATALOG_DOWNLOAD_LINK_MAX_AGE = 7 * 24 * 3600
+
+# Let the front server send book PDFs once the view has checked access:
+# 'x-accel' for nginx (an internal location mapping CATALOG_FILE_OFFLOAD_PREFIX
+# onto MEDIA_ROOT), 'x-sendfile' for Apache mod_xsendfile, None to stream
+# them from Django.
+CATALOG_FILE_OFFLOAD = os.environ.get('CATALOG_FILE_OFFLOAD') or None
+CATALOG_FILE_OFFLOAD_PREFIX = '/protected-media/'
+
+# Days a copy returned for a reservation is held for its patron before the
+# expire_reservations command passes it to the next in line.
+CATALOG_RESERVATION_HOLD_DAYS = 3
+
 LOGIN_URL = '/catalog/customer_login/'
 
+# Cache alias holding the rendered catalog page fragments and their model
+# versions, and how long an unused fragment is kept. With several server
+# processes point it at a shared backend (file, memcached) so invalidations
+# made by one process reach the others.
+CATALOG_FRAGMENT_CACHE = 'default'
+CATALOG_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Maximum number of ranked matches returned by catalog.search.search_books. The
+# search page ranks in SQL and pages through every match.
+CATALOG_SEARCH_RESULT_LIMIT = 200
+
+# Share of requests profiled by catalog.profiling.PerformanceMiddleware, and how
+# often one SQL statement may repeat in a request before it is flagged. Off
+# unless the environment turns it on, e.g. CATALOG_PERFORMANCE_SAMPLE_RATE=0.05
+# in production, so tests and development servers log nothing.
+CATALOG_PERFORMANCE_SAMPLE_RATE = float(os.environ.get('CATALOG_PERFORMANCE_SAMPLE_RATE', '0'))
+CATALOG_PERFORMANCE_DUPLICATE_THRESHOLD = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'catalog.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('CATALOG_PERFORMANCE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Heroku: Update database configuration from $DATABASE_URL.
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
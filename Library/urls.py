@@ -19,6 +19,8 @@ from django.views.generic import RedirectView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from catalog.delivery import serve_public_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('catalog/', include('catalog.urls')),
@@ -27,5 +29,6 @@ urlpatterns = [
 
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Book files are left to the catalog's download views, which check access.
+    urlpatterns += static(settings.MEDIA_URL, serve_public_media, document_root=settings.MEDIA_ROOT)
 
@@ -1,7 +1,10 @@
 from django.contrib import admin
-from catalog.models import Author, Genre, Book, BookInstance, Profile
+from catalog import bulk, stats
+from catalog.templatetags.catalog_images import responsive_image
+from catalog.models import Author, Genre, Book, BookInstance, DownloadLink, OutboundEmail, OverdueReminder, Profile, Reservation
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Register your models here.
 STATUS_MAINTENANCE = 'm'
@@ -18,24 +21,45 @@ STATUS_CHOICES = (
 
 
 class AuthorAdmin(admin.ModelAdmin):
-    list_display = ('first_name', 'last_name', 'date_of_birth', 'date_of_death')
+    list_display = ('portrait', 'first_name', 'last_name', 'date_of_birth', 'date_of_death')
     fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death'), 'author_profile_picture']
 
+    def portrait(self, obj):
+        return responsive_image(obj.author_profile_picture, 'thumb')
+
 
 class BooksInstanceInline(admin.TabularInline):
     model = BookInstance
 
 
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author')
+    list_display = ('cover', 'title', 'author')
     filter_horizontal = ('genre',)
     list_filter = ('author',)
     inlines = [BooksInstanceInline]
 
+    def cover(self, obj):
+        return responsive_image(obj.picture, 'thumb')
+
+
+class OverdueListFilter(admin.SimpleListFilter):
+    title = 'overdue'
+    parameter_name = 'overdue'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.overdue()
+        if self.value() == 'no':
+            return queryset.exclude(status=BookInstance.STATUS_ON_LOAN, due_back__lt=timezone.localdate())
+        return queryset
+
 
 class BookInstanceAdmin(admin.ModelAdmin):
-    list_display = ('book', 'status', 'borrower', 'due_back', 'id')
-    list_filter = ('status', 'due_back')
+    list_display = ('book', 'status', 'borrower', 'due_back', 'days_overdue', 'id')
+    list_filter = ('status', OverdueListFilter, 'due_back')
     fieldsets = (
         (None, {
             'fields': ('book', 'id')
@@ -44,26 +68,68 @@ class BookInstanceAdmin(admin.ModelAdmin):
             'fields': ('status', 'due_back', 'borrower')
         }),
     )
-    actions = ['book_onloan', 'book_available', 'book_maintenance', 'book_reserved']
+    actions = ['book_onloan', 'book_available', 'book_maintenance']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_overdue()
+
+    def days_overdue(self, obj):
+        return obj.days_overdue
+    days_overdue.admin_order_field = 'overdue_by'
 
     def book_onloan(self, request, queryset):
-        queryset.update(status=STATUS_ON_LOAN)
+        # A copy held for a reservation stays with it; cancel the reservation first.
+        held = queryset.filter(status=STATUS_RESERVED).count()
+        stats.update_status(queryset.exclude(status=STATUS_RESERVED), STATUS_ON_LOAN)
+        if held:
+            self.message_user(request, '%d copies held for reservations were left alone' % held)
     book_onloan.short_description = "Mark book status - On Loan"
 
+    def apply_transition(self, request, queryset, action):
+        summary = {}
+        for _, result, _ in bulk.apply(action, ids=[str(pk) for pk in queryset.values_list('pk', flat=True)]):
+            summary[result] = summary.get(result, 0) + 1
+        self.message_user(request, ', '.join('%d %s' % (count, result) for result, count in sorted(summary.items())))
+
     def book_available(self, request, queryset):
-        queryset.update(status=STATUS_AVAILABLE)
+        # A check-in also clears the borrower and due date, and serves reservations.
+        self.apply_transition(request, queryset, 'checkin')
 
     book_available.short_description = "Mark book status - Available"
 
     def book_maintenance(self, request, queryset):
-        queryset.update(status=STATUS_MAINTENANCE)
+        self.apply_transition(request, queryset, 'maintenance')
 
     book_maintenance.short_description = "Mark book status - Maintenance"
 
-    def book_reserved(self, request, queryset):
-        queryset.update(status=STATUS_RESERVED)
 
-    book_reserved.short_description = "Mark book status - Reserved"
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        queryset.exclude(status=OutboundEmail.STATUS_SENT).update(
+            status=OutboundEmail.STATUS_PENDING, next_attempt_at=timezone.now())
+
+    retry_now.short_description = "Retry delivery now"
+
+
+class DownloadLinkAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'created_at', 'downloads', 'last_downloaded_at')
+    readonly_fields = ('created_at', 'downloads', 'last_downloaded_at')
+
+
+class OverdueReminderAdmin(admin.ModelAdmin):
+    list_display = ('borrower', 'sent_on', 'loans', 'email')
+    list_filter = ('sent_on',)
+    raw_id_fields = ('borrower', 'email')
+
+
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'position', 'status', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    raw_id_fields = ('book', 'user', 'copy')
 
 
 class ProfileInline(admin.StackedInline):
@@ -82,6 +148,10 @@ admin.site.register(Book, BookAdmin)
 admin.site.register(Author, AuthorAdmin)
 admin.site.register(Genre)
 admin.site.register(BookInstance, BookInstanceAdmin)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
+admin.site.register(DownloadLink, DownloadLinkAdmin)
+admin.site.register(OverdueReminder, OverdueReminderAdmin)
+admin.site.register(Reservation, ReservationAdmin)
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 
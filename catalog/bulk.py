@@ -0,0 +1,199 @@
+"""
+    Bulk status changes of copies, for staff inventory runs.
+
+    ``apply`` moves copies through one of the ``TRANSITIONS``. The copies are
+    named by id or picked by a filter expression. They are handled in chunks
+    of ``CHUNK_SIZE``, with one transaction per chunk:
+
+    - the copies of the chunk are locked and read;
+    - one ``UPDATE`` moves those in an allowed status and sets the borrower
+      and due date of the new status;
+    - the counters, the book availability columns and the reservation queues
+      are kept in step, as ``catalog.loans`` does for a single copy.
+
+    Each requested copy gets a ``(id, result, status)`` triple, yielded as
+    soon as its chunk has committed, so a run over tens of thousands of
+    barcodes reports as it goes and keeps memory use flat.
+"""
+import datetime
+import uuid
+from collections import OrderedDict
+from itertools import islice
+from urllib.parse import parse_qsl
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from catalog import loans, reservations, stats
+from catalog.models import Book, BookInstance, CatalogCounter, Reservation
+
+CHUNK_SIZE = 500
+
+# Target status and the statuses a copy may be moved from.
+# A copy held for a reservation is never moved; cancel the reservation first.
+TRANSITIONS = OrderedDict([
+    ('checkin', (BookInstance.STATUS_AVAILABLE,
+                 (BookInstance.STATUS_ON_LOAN, BookInstance.STATUS_MAINTENANCE))),
+    ('checkout', (BookInstance.STATUS_ON_LOAN,
+                  (BookInstance.STATUS_AVAILABLE,))),
+    ('maintenance', (BookInstance.STATUS_MAINTENANCE,
+                     (BookInstance.STATUS_AVAILABLE, BookInstance.STATUS_ON_LOAN))),
+])
+
+OK = 'ok'
+UNCHANGED = 'unchanged'
+CONFLICT = 'conflict'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+FILTER_FIELDS = {'status', 'book', 'book__isbn', 'borrower', 'borrower__username', 'due_back'}
+FILTER_LOOKUPS = {'exact', 'in', 'lt', 'lte', 'gt', 'gte', 'isnull'}
+
+
+class BulkError(ValueError):
+    pass
+
+
+def parse_filter(expression):
+    """
+        The copies matching a query-string expression such as
+        ``status=o&due_back__lt=2024-01-31``.
+    """
+    conditions = {}
+    for name, value in parse_qsl(expression, keep_blank_values=True):
+        field, _, lookup = name.rpartition('__')
+        if lookup not in FILTER_LOOKUPS:
+            field, lookup = name, 'exact'
+        if field not in FILTER_FIELDS:
+            raise BulkError('Cannot filter copies on %r' % name)
+        if lookup == 'in':
+            value = [part for part in value.split(',') if part]
+        elif lookup == 'isnull':
+            value = value.lower() in ('1', 'true', 'yes')
+        conditions['%s__%s' % (field, lookup)] = value
+    if not conditions:
+        raise BulkError('The filter selects no condition')
+    try:
+        return BookInstance.objects.filter(**conditions)
+    except (ValueError, ValidationError) as exc:
+        raise BulkError('Invalid filter %r: %s' % (expression, exc))
+
+
+def parse_ids(values):
+    """
+        ``(value, UUID or None)`` for each non-blank value, barcodes as read.
+    """
+    for value in values:
+        value = value.strip()
+        if not value:
+            continue
+        try:
+            yield value, uuid.UUID(value)
+        except ValueError:
+            yield value, None
+
+
+def batched(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def filtered_ids(queryset, chunk_size):
+    # Keyset over the primary key: updated copies may stop matching the filter.
+    last = None
+    while True:
+        page = queryset.order_by('pk')
+        if last is not None:
+            page = page.filter(pk__gt=last)
+        copy_ids = list(page.values_list('pk', flat=True)[:chunk_size])
+        if not copy_ids:
+            return
+        last = copy_ids[-1]
+        yield [(str(pk), pk) for pk in copy_ids]
+
+
+def apply(action, ids=None, where=None, borrower=None, due_back=None, chunk_size=CHUNK_SIZE):
+    """
+        Move the copies ``ids`` (an iterable of id strings), or those matching
+        the filter expression ``where``, through ``action``. Copies checked out
+        are lent to ``borrower`` until ``due_back``.
+
+        The request is checked straight away, raising ``BulkError``; the copies
+        are moved while the returned iterator of results is consumed.
+    """
+    if action not in TRANSITIONS:
+        raise BulkError('Unknown action %r, use one of %s' % (action, ', '.join(TRANSITIONS)))
+    if action == 'checkout' and borrower is None:
+        raise BulkError('Checking copies out needs a borrower')
+    if (ids is None) == (where is None):
+        raise BulkError('Give either copy ids or a filter')
+    if action == 'checkout':
+        due_back = due_back or datetime.date.today() + loans.LOAN_PERIOD
+    else:
+        borrower = due_back = None
+
+    if where is not None:
+        batches = filtered_ids(parse_filter(where), chunk_size)
+    else:
+        batches = batched(parse_ids(ids), chunk_size)
+    return (result for batch in batches for result in apply_chunk(action, batch, borrower, due_back))
+
+
+def apply_chunk(action, batch, borrower, due_back):
+    target, sources = TRANSITIONS[action]
+    copy_ids = {pk for _, pk in batch if pk is not None}
+    with transaction.atomic():
+        copies = BookInstance.objects.filter(pk__in=copy_ids)
+        found = {pk: (status, book_id) for pk, status, book_id in
+                 copies.select_for_update().values_list('pk', 'status', 'book_id')}
+        moving = [pk for pk, (status, _) in found.items() if status in sources]
+        held = set()
+        if moving:
+            copies.filter(pk__in=moving).update(status=target, borrower=borrower, due_back=due_back)
+            book_ids = {found[pk][1] for pk in moving}
+            if target == BookInstance.STATUS_AVAILABLE:
+                held = hold_for_reservations(moving, found)
+            left = sum(1 for pk in moving if found[pk][0] == BookInstance.STATUS_AVAILABLE)
+            arrived = len(moving) - len(held) if target == BookInstance.STATUS_AVAILABLE else 0
+            stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, arrived - left)
+            stats.refresh_books(book_ids)
+
+    moved = set(moving)
+    for value, pk in batch:
+        if pk is None:
+            yield value, INVALID, None
+        elif pk not in found:
+            yield value, NOT_FOUND, None
+        elif pk in moved:
+            yield value, OK, BookInstance.STATUS_RESERVED if pk in held else target
+        elif found[pk][0] == target and target != BookInstance.STATUS_ON_LOAN:
+            yield value, UNCHANGED, target
+        else:
+            yield value, CONFLICT, found[pk][0]
+
+
+def hold_for_reservations(copy_ids, found):
+    """
+        Hold checked-in copies for the patrons waiting for their books and
+        return the ids of the copies held.
+    """
+    book_ids = sorted({found[pk][1] for pk in copy_ids})
+    # Lock the books in a fixed order up front, as assign() would lock them in
+    # copy order and two overlapping chunks could then wait on each other.
+    list(Book.objects.select_for_update().filter(pk__in=book_ids).order_by('pk').values_list('pk', flat=True))
+    queued = set(Reservation.objects.filter(book_id__in=book_ids, status=Reservation.STATUS_WAITING)
+                 .values_list('book_id', flat=True).distinct())
+    held = set()
+    for pk in copy_ids:
+        book_id = found[pk][1]
+        if book_id not in queued:
+            continue
+        if reservations.assign(pk, book_id) is None:
+            queued.discard(book_id)
+        else:
+            held.add(pk)
+    return held
@@ -0,0 +1,105 @@
+"""
+    Conditional GET for the catalog pages.
+
+    ``conditional_page`` answers ``304 Not Modified`` when the copy of a page a
+    browser already holds is still current. That is judged from validators
+    that a small query computes without rendering: the ``updated_at`` of the
+    books or authors shown and, for lists, their ``CatalogCounter``, since a
+    deletion moves no timestamp. The ETag also covers the user and the query
+    string, as pages differ between staff and patrons, and the CSRF secret, as
+    the pages embed forms whose token a new login replaces. Responses are marked
+    ``private, no-cache``: browsers revalidate every time and shared caches
+    keep nothing.
+
+    ``Book.updated_at`` is moved by ``touch_books`` from ``catalog.signals``
+    when a book's genres or author change, and by ``stats.refresh_books`` when
+    one of its copies does.
+"""
+import hashlib
+
+from django.db.models import Count, DateTimeField, Max, Subquery
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from catalog.models import Author, Book, CatalogCounter
+
+
+def touch_books(book_ids):
+    book_ids = set(book_ids)
+    if book_ids:
+        Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+
+
+def conditional_page(validators):
+    """
+        View decorator for a page described by ``validators(request, **kwargs)``:
+        a ``(last_modified, values)`` pair, ``values`` changing whenever the page
+        does, or ``(None, None)`` if there is no such page.
+    """
+    def cached(request, **kwargs):
+        # condition() asks for the ETag and Last-Modified separately.
+        if not hasattr(request, '_catalog_validators'):
+            request._catalog_validators = validators(request, **kwargs)
+        return request._catalog_validators
+
+    def etag(request, *args, **kwargs):
+        values = cached(request, **kwargs)[1]
+        if values is None:
+            return None
+        user = request.user
+        # get_token() masks the secret differently on every call; the cookie it
+        # leaves in META is stable until the secret is rotated.
+        get_token(request)
+        key = repr((user.pk, user.is_staff, request.META['CSRF_COOKIE'], request.get_full_path()) + tuple(values))
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return cached(request, **kwargs)[0]
+
+    def decorator(view):
+        return cache_control(private=True, no_cache=True)(condition(etag, last_modified)(view))
+    return decorator
+
+
+def latest(*timestamps):
+    return max((timestamp for timestamp in timestamps if timestamp is not None), default=None)
+
+
+def listing(model, counter):
+    # The counter notices deletions without a COUNT over the table; filtered
+    # and paginated lists share the validators of the whole table.
+    newest = model.objects.order_by('-updated_at').values('updated_at')[:1]
+    row = (CatalogCounter.objects.filter(name=counter)
+           .annotate(updated_at=Subquery(newest, output_field=DateTimeField()))
+           .values_list('value', 'updated_at').first())
+    if row is None:
+        return None, None
+    return row[1], row
+
+
+def book_list(request, **kwargs):
+    return listing(Book, CatalogCounter.BOOKS)
+
+
+def book_detail(request, pk):
+    updated_at = Book.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    return updated_at, (updated_at,)
+
+
+def author_list(request, **kwargs):
+    return listing(Author, CatalogCounter.AUTHORS)
+
+
+def author_detail(request, pk):
+    author = (Author.objects.filter(pk=pk)
+              .annotate(num_books=Count('book'), books_updated_at=Max('book__updated_at')).first())
+    # AuthorDetailView shows this row rather than reading it again.
+    request.catalog_object = author
+    if author is None:
+        return None, None
+    return latest(author.updated_at, author.books_updated_at), (author.updated_at, author.num_books,
+                                                                 author.books_updated_at)
@@ -0,0 +1,129 @@
+"""
+    Synthetic library generator used for load tests and benchmarks.
+
+    Rows are written with ``bulk_create`` in batches, so signals do not run;
+    the book availability columns, the catalog statistics and the search
+    index are rebuilt once at the end.
+"""
+import random
+import uuid
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+from catalog import search, stats
+from catalog.models import Author, Book, BookInstance, Genre, Profile
+
+FIRST_NAMES = ('Jane', 'Mark', 'Marcel', 'James', 'Stella', 'Mary', 'Leo', 'Virginia', 'Franz', 'Toni',
+               'Gabriel', 'Chinua', 'Haruki', 'Doris', 'Italo', 'Zadie')
+LAST_NAMES = ('Austen', 'Twain', 'Proust', 'Joyce', 'Gibbons', 'Shelley', 'Tolstoy', 'Woolf', 'Kafka',
+              'Morrison', 'Marquez', 'Achebe', 'Murakami', 'Lessing', 'Calvino', 'Smith')
+GENRE_NAMES = ('Fiction', 'Science Fiction', 'Fantasy', 'Mystery', 'Romance', 'Horror', 'History',
+               'Biography', 'Poetry', 'Drama', 'Philosophy', 'Travel')
+TITLE_WORDS = ('House', 'River', 'Night', 'Garden', 'Shadow', 'Winter', 'Letters', 'Stone', 'City',
+               'Silence', 'Journey', 'Island', 'Memory', 'Fire', 'Song', 'Empire', 'Harvest', 'Mirror')
+
+# Share of copies in each status; on-loan copies get a borrower and a due date.
+DEFAULT_STATUS_MIX = {
+    BookInstance.STATUS_AVAILABLE: 50,
+    BookInstance.STATUS_ON_LOAN: 35,
+    BookInstance.STATUS_MAINTENANCE: 10,
+    BookInstance.STATUS_RESERVED: 5,
+}
+
+DEFAULT_PASSWORD = 'library-load-test'
+
+
+def _bulk_create(model, objects, batch_size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def _new_ids(model, max_before):
+    return list(model.objects.filter(pk__gt=max_before or 0).order_by().values_list('pk', flat=True))
+
+
+def _max_pk(model):
+    return model.objects.aggregate(max_pk=Max('pk'))['max_pk']
+
+
+def generate(authors=100, genres=12, books=1000, copies=5000, users=100, status_mix=None,
+             overdue_share=0.2, batch_size=1000, seed=None, password=DEFAULT_PASSWORD):
+    """
+        Add a synthetic library to the database and return the number of rows created per model.
+    """
+    rng = random.Random(seed)
+    token = uuid.UUID(int=rng.getrandbits(128)).hex[:5]
+    status_mix = status_mix or DEFAULT_STATUS_MIX
+    statuses, weights = zip(*status_mix.items())
+    today = date.today()
+
+    with transaction.atomic():
+        max_author, max_genre, max_book, max_user = (_max_pk(model) for model in (Author, Genre, Book, User))
+
+        _bulk_create(Author, (
+            Author(first_name=rng.choice(FIRST_NAMES), last_name='%s %d' % (rng.choice(LAST_NAMES), n),
+                   date_of_birth=date(rng.randint(1700, 1990), rng.randint(1, 12), rng.randint(1, 28)))
+            for n in range(authors)), batch_size)
+        author_ids = _new_ids(Author, max_author)
+
+        _bulk_create(Genre, (
+            Genre(name=GENRE_NAMES[n % len(GENRE_NAMES)] + ('' if n < len(GENRE_NAMES) else ' %d' % n))
+            for n in range(genres)), batch_size)
+        genre_ids = _new_ids(Genre, max_genre)
+
+        _bulk_create(Book, (
+            Book(title='The %s of %s %d' % (rng.choice(TITLE_WORDS), rng.choice(TITLE_WORDS), n),
+                 summary=' '.join(rng.choice(TITLE_WORDS).lower() for _ in range(30)),
+                 isbn='%s%08d' % (token, n), author_id=rng.choice(author_ids) if author_ids else None)
+            for n in range(books)), batch_size)
+        book_ids = _new_ids(Book, max_book)
+
+        if genre_ids:
+            _bulk_create(Book.genre.through, (
+                Book.genre.through(book_id=book_id, genre_id=genre_id)
+                for book_id in book_ids
+                for genre_id in rng.sample(genre_ids, min(len(genre_ids), rng.randint(1, 3)))), batch_size)
+
+        password_hash = make_password(password)
+        _bulk_create(User, (
+            User(username='reader_%s_%d' % (token, n), email='reader_%s_%d@example.com' % (token, n),
+                 password=password_hash)
+            for n in range(users)), batch_size)
+        user_ids = _new_ids(User, max_user)
+        _bulk_create(Profile, (Profile(user_id=user_id, phone_number='%010d' % user_id) for user_id in user_ids),
+                     batch_size)
+
+        def make_copy():
+            status = rng.choices(statuses, weights)[0]
+            instance = BookInstance(book_id=rng.choice(book_ids), status=status)
+            if status == BookInstance.STATUS_ON_LOAN and user_ids:
+                instance.borrower_id = rng.choice(user_ids)
+                if rng.random() < overdue_share:
+                    instance.due_back = today - timedelta(days=rng.randint(1, 60))
+                else:
+                    instance.due_back = today + timedelta(days=rng.randint(0, 21))
+            return instance
+
+        if book_ids:
+            _bulk_create(BookInstance, (make_copy() for _ in range(copies)), batch_size)
+            Book.objects.filter(pk__gt=max_book or 0).update(**stats.availability_columns())
+
+    stats.reconcile()
+    search.rebuild_index()
+    return {
+        'authors': len(author_ids),
+        'genres': len(genre_ids),
+        'books': len(book_ids),
+        'copies': copies if book_ids else 0,
+        'users': len(user_ids),
+    }
@@ -0,0 +1,209 @@
+"""
+    Book PDF delivery: expiring download links and the file response.
+
+    Instead of attaching the PDF, the email carries a link whose token is the
+    ``DownloadLink`` id signed with ``SECRET_KEY`` and a timestamp, so it cannot
+    be forged or used after ``CATALOG_DOWNLOAD_LINK_MAX_AGE`` seconds. Each
+    download of a link is counted on its row, once per response that sends
+    the file from its start.
+
+    ``serve_book_file`` answers both the links and the logged-in download view,
+    with byte ranges, conditional requests and optional front server offload.
+    ``serve_public_media`` serves the rest of the media in development and
+    never a book file.
+"""
+import os
+import posixpath
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.text import slugify
+from django.views import static
+
+from catalog.models import Book, DownloadLink
+from catalog.storage import content_digest, is_content_addressed
+
+signer = signing.TimestampSigner(salt='catalog.delivery')
+
+# Bytes read from the file per chunk when Django streams a PDF itself.
+FILE_BLOCK_SIZE = 64 * 1024
+
+# Where book files were uploaded before they were content-addressed.
+BOOK_FILE_DIRECTORY = 'book_pdf/'
+
+
+class InvalidLink(Exception):
+    pass
+
+
+class ExpiredLink(InvalidLink):
+    pass
+
+
+def create_link(book, user=None):
+    """
+        Create a download link for ``book`` and return its signed token.
+    """
+    link = DownloadLink.objects.create(book=book, user=user)
+    return signer.sign(link.pk.hex)
+
+
+def resolve(token):
+    """
+        Return the link a token was issued for.
+    """
+    max_age = getattr(settings, 'CATALOG_DOWNLOAD_LINK_MAX_AGE', 7 * 24 * 3600)
+    try:
+        link_id = signer.unsign(token, max_age=max_age)
+    except signing.SignatureExpired:
+        raise ExpiredLink('Download link has expired')
+    except signing.BadSignature:
+        raise InvalidLink('Download link is not valid')
+
+    try:
+        return DownloadLink.objects.select_related('book').get(pk=link_id)
+    except DownloadLink.DoesNotExist:
+        raise InvalidLink('Download link no longer exists')
+
+
+def is_download(request, response):
+    """
+        Whether a response to a link sends the file from its first byte. The
+        other ranges a PDF viewer fetches and the revalidations are not counted.
+    """
+    if response.status_code == 206:
+        return response['Content-Range'].startswith('bytes 0-')
+    if response.status_code != 200:
+        return False
+    if response.has_header('X-Accel-Redirect') or response.has_header('X-Sendfile'):
+        # The front server answers the range itself.
+        byte_range = request.META.get('HTTP_RANGE', '').replace(' ', '')
+        return not byte_range or byte_range.startswith('bytes=0-')
+    return True
+
+
+def count_download(link):
+    DownloadLink.objects.filter(pk=link.pk).update(downloads=F('downloads') + 1, last_downloaded_at=timezone.now())
+
+
+class RangeFile:
+    """
+        Read-only view of ``length`` bytes of ``file`` starting at ``start``.
+    """
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+        Return the ``(start, end)`` of a single-range ``Range`` header, ``None``
+        to serve the whole file, or raise ``ValueError`` if it is unsatisfiable.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        # Multiple ranges are allowed to be answered with the whole file.
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def serve_book_file(request, book, as_attachment=False):
+    """
+        Serve a book's PDF honouring conditional and byte-range requests.
+
+        The file is streamed in blocks, or handed to the front server with
+        ``X-Accel-Redirect``/``X-Sendfile`` when ``CATALOG_FILE_OFFLOAD`` is set.
+    """
+    size = book.file.size
+    modified = int(book.file.storage.get_modified_time(book.file.name).timestamp())
+    last_modified = http_date(modified)
+    if is_content_addressed(book.file.name):
+        etag = '"%s"' % content_digest(book.file.name)
+        filename = (slugify(book.title) or 'book') + os.path.splitext(book.file.name)[1]
+    else:
+        etag = '"%x-%x"' % (modified, size)
+        filename = os.path.basename(book.file.name)
+
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+    if response is not None:
+        return response
+
+    offload = getattr(settings, 'CATALOG_FILE_OFFLOAD', None)
+    if offload == 'x-accel':
+        # nginx serves the file, ranges and all, from an internal location.
+        response = HttpResponse(content_type='application/pdf')
+        response['X-Accel-Redirect'] = settings.CATALOG_FILE_OFFLOAD_PREFIX + book.file.name
+    elif offload == 'x-sendfile':
+        response = HttpResponse(content_type='application/pdf')
+        response['X-Sendfile'] = book.file.path
+    else:
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) in (etag, last_modified):
+            try:
+                byte_range = parse_range(request.META['HTTP_RANGE'], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % size
+                return response
+
+        if byte_range is None:
+            response = FileResponse(book.file.open('rb'), content_type='application/pdf')
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            response = FileResponse(RangeFile(book.file.open('rb'), start, end - start + 1),
+                                    status=206, content_type='application/pdf')
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response.block_size = FILE_BLOCK_SIZE
+
+    if is_content_addressed(book.file.name):
+        # The name is the content's hash, so the file at it can never change.
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Content-Disposition'] = '%s; filename="%s"' % ('attachment' if as_attachment else 'inline', filename)
+    return response
+
+
+def is_book_file(name):
+    return name.startswith(BOOK_FILE_DIRECTORY) or Book.objects.filter(file=name).exists()
+
+
+def serve_public_media(request, path, document_root=None, show_indexes=False):
+    """
+        ``django.views.static.serve`` for the media URL under ``DEBUG``. Book
+        files sit in the same media root but are only served by the access
+        checked views.
+    """
+    if is_book_file(posixpath.normpath(path).lstrip('/')):
+        raise Http404('"%s" does not exist' % path)
+    return static.serve(request, path, document_root=document_root, show_indexes=show_indexes)
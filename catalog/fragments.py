@@ -0,0 +1,89 @@
+"""
+    Cached HTML fragments of the catalog pages.
+
+    A fragment key holds the id of the object it shows, whether it was
+    rendered for staff or for a patron, and the current version of every
+    model it depends on. The receivers in ``catalog.signals`` ``bump`` the
+    version of Book, Author and Genre whenever one is saved or deleted, or a
+    book's genres change, so every fragment built from the old data is
+    orphaned and left to expire.
+
+    Versions are kept in the same cache as the fragments (the
+    ``CATALOG_FRAGMENT_CACHE`` alias), so a bump reaches every process
+    sharing that cache. A lost version restarts from the current time in
+    microseconds, never from a number an older fragment was stored under.
+"""
+import hashlib
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_FRAGMENT_CACHE', 'default')]
+
+
+def get_model(model):
+    if isinstance(model, str):
+        return apps.get_model('catalog', model)
+    return model
+
+
+def version_key(model):
+    return 'catalog.fragments.version:%s' % get_model(model)._meta.label_lower
+
+
+def initial_version():
+    return int(time.time() * 1000000)
+
+
+def versions(models):
+    cache = get_cache()
+    keys = [version_key(model) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, initial_version(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(model):
+    """
+        Invalidate every fragment depending on ``model``. The version is bumped
+        again once the transaction commits, so a fragment rendered by another
+        request from the data as it was before the commit is not kept.
+    """
+    def increment():
+        cache = get_cache()
+        key = version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, initial_version(), None)
+
+    increment()
+    transaction.on_commit(increment)
+
+
+def fragment_key(name, models, vary_on=(), staff=False):
+    vary = hashlib.md5(':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return 'catalog.fragments:%s:%s:%s:%s' % (name, 'staff' if staff else 'patron',
+                                              '.'.join(str(version) for version in versions(models)), vary)
+
+
+def get_or_render(name, models, render, vary_on=(), staff=False):
+    """
+        Return the cached fragment ``name`` of the objects ``vary_on``, calling
+        ``render()`` to build and store it when it is missing or out of date.
+    """
+    cache = get_cache()
+    key = fragment_key(name, models, vary_on, staff)
+    content = cache.get(key)
+    if content is None:
+        content = render()
+        cache.set(key, content, getattr(settings, 'CATALOG_FRAGMENT_CACHE_TIMEOUT', 3600))
+    return content
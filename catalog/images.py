@@ -0,0 +1,146 @@
+"""
+    Resized renditions of uploaded images.
+
+    Every cover and portrait is served through fixed-size renditions (see
+    ``RENDITIONS``) at 1x and 2x density, as WebP and JPEG. Renditions live in
+    the default storage under ``renditions/`` keyed by the SHA-256 of the
+    source image, so a re-upload of the same picture reuses them and a changed
+    picture never serves stale ones. They are made when an image is uploaded,
+    or on first use by the ``responsive_image`` template tag.
+"""
+import hashlib
+import io
+import posixpath
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from catalog.storage import content_digest, is_content_addressed
+from catalog.models import Author, Book, Profile
+
+# Bounding boxes in CSS pixels; images are scaled down to fit, never up.
+RENDITIONS = {
+    'thumb': (60, 80),
+    'card': (180, 250),
+    'detail': (220, 300),
+}
+DENSITIES = (1, 2)
+FORMATS = ('webp', 'jpeg') if features.check('webp') else ('jpeg',)
+QUALITY = 82
+
+RENDITION_DIR = 'renditions'
+
+IMAGE_FIELDS = {
+    Book: ('picture',),
+    Author: ('author_profile_picture',),
+    Profile: ('profile_picture',),
+}
+
+
+def source_digest(image):
+    """
+        SHA-256 of an image file, cached per name, size and modification time.
+    """
+    if is_content_addressed(image.name):
+        return content_digest(image.name)
+    storage = image.storage
+    stamp = storage.get_modified_time(image.name).timestamp()
+    key = 'catalog.images.digest:%s:%d:%d' % (hashlib.md5(image.name.encode()).hexdigest(), storage.size(image.name),
+                                               stamp)
+    digest = cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with storage.open(image.name, 'rb') as source:
+            for chunk in iter(lambda: source.read(64 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        cache.set(key, digest, None)
+    return digest
+
+
+def rendition_name(digest, rendition, density, fmt):
+    # The bounding box is part of the name so resized renditions never reuse old files.
+    width, height = RENDITIONS[rendition]
+    return posixpath.join(RENDITION_DIR, digest[:2], digest,
+                          '%s-%dx%d-%dx.%s' % (rendition, width, height, density, fmt))
+
+
+def resize(source, rendition, density, fmt):
+    """
+        Scale an opened PIL image into a rendition and return its encoded bytes and size.
+    """
+    width, height = RENDITIONS[rendition]
+    image = source.copy()
+    image.thumbnail((width * density, height * density), Image.LANCZOS)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = flatten(image)
+    elif fmt == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    output = io.BytesIO()
+    image.save(output, format=fmt.upper(), quality=QUALITY, optimize=fmt == 'jpeg', progressive=fmt == 'jpeg')
+    return output.getvalue(), image.size
+
+
+def flatten(image):
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[3])
+    return background
+
+
+def open_source(image):
+    with image.storage.open(image.name, 'rb') as source:
+        opened = Image.open(source)
+        opened.load()
+    return ImageOps.exif_transpose(opened)
+
+
+def image_size(storage, name):
+    with storage.open(name, 'rb') as file:
+        return Image.open(file).size
+
+
+def make_renditions(image, rendition, digest=None, storage=default_storage, force=False):
+    """
+        Write the missing files of one rendition of an image, or all of them with
+        ``force``, and return its description: ``{'width': ..., 'height': ...,
+        'sources': {format: [(url, density), ...]}}``.
+    """
+    digest = digest or source_digest(image)
+    source = None
+    description = {'width': None, 'height': None, 'sources': {}}
+    for fmt in FORMATS:
+        for density in DENSITIES:
+            name = rendition_name(digest, rendition, density, fmt)
+            if force:
+                storage.delete(name)
+            if storage.exists(name):
+                size = None
+            else:
+                if source is None:
+                    source = open_source(image)
+                data, size = resize(source, rendition, density, fmt)
+                storage.save(name, ContentFile(data))
+            if density == 1 and description['width'] is None:
+                description['width'], description['height'] = size or image_size(storage, name)
+            description['sources'].setdefault(fmt, []).append((storage.url(name), density))
+    return description
+
+
+def renditions(image, rendition):
+    """
+        Cached ``make_renditions``: the files are only checked once per source image.
+    """
+    key = 'catalog.images:%s:%s:%dx%d' % ((source_digest(image), rendition) + RENDITIONS[rendition])
+    description = cache.get(key)
+    if description is None:
+        description = make_renditions(image, rendition)
+        cache.set(key, description, None)
+    return description
+
+
+def make_all_renditions(image, force=False):
+    digest = source_digest(image)
+    return {rendition: make_renditions(image, rendition, digest, force=force) for rendition in RENDITIONS}
@@ -0,0 +1,322 @@
+"""
+    Bulk catalog import from CSV, JSON Lines and MARC21 files.
+
+    Records are streamed from the file one at a time and written in batches:
+    one transaction and a handful of ``bulk_create`` calls per batch, for the
+    new authors and genres, the books, their genre rows and their copies.
+    Authors and genres are resolved through dictionaries loaded once, so a
+    known name costs no query. A book already in the catalog is skipped: one
+    with the same ISBN or, for a record without an ISBN, a book without one
+    that has the same title and author. This also makes an interrupted import
+    safe to run again.
+
+    ``bulk_create`` sends no signals, so each batch also sets the book
+    availability columns, adjusts the catalog counters and indexes the new
+    books for search; the fragment cache is expired once at the end.
+
+    CSV and JSON Lines records have the fields ``title``, ``author`` ("First
+    Last" or "Last, First"), ``summary``, ``isbn``, ``genres`` (a list, or
+    names separated by ``;`` in CSV) and ``copies``. MARC21 records are read
+    from tags 020 (ISBN), 100 (author), 245 (title), 520 (summary) and 650
+    (genres).
+"""
+import csv
+import json
+import os
+
+from django.db import transaction
+from django.db.models import Max
+
+from catalog import fragments, search, stats
+from catalog.models import Author, Book, BookInstance, CatalogCounter, Genre
+
+# Largest number of values bound in one IN (...) query, within SQLite's limit.
+QUERY_CHUNK = 500
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.mrc': 'marc',
+    '.marc': 'marc',
+}
+
+MARC_RECORD_END = b'\x1d'
+MARC_FIELD_END = b'\x1e'
+MARC_SUBFIELD = b'\x1f'
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def chunks(items, size=QUERY_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def detect_format(path):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as source:
+        for number, row in enumerate(csv.DictReader(source), 2):
+            yield number, row
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as source:
+        for number, line in enumerate(source, 1):
+            if line.strip():
+                yield number, line
+
+
+def parse_json(line):
+    try:
+        record = json.loads(line)
+    except ValueError as exc:
+        raise InvalidRecord('not valid JSON: %s' % exc)
+    if not isinstance(record, dict):
+        raise InvalidRecord('not a JSON object')
+    return record
+
+
+def read_marc(path):
+    with open(path, 'rb') as source:
+        number = 0
+        while True:
+            head = source.read(5)
+            if not head.strip(b'\r\n'):
+                return
+            number += 1
+            if not head.isdigit():
+                raise ValueError('Record %d: invalid MARC record length %r' % (number, head))
+            yield number, head + source.read(int(head) - 5)
+
+
+def marc_fields(data):
+    """
+        ``(tag, {code: [values]})`` for each data field of an ISO 2709 record.
+    """
+    if not data.endswith(MARC_RECORD_END):
+        raise InvalidRecord('truncated MARC record')
+    try:
+        base = int(data[12:17])
+    except ValueError:
+        raise InvalidRecord('invalid MARC leader')
+    directory = data[24:base - 1]
+    for offset in range(0, len(directory) - 11, 12):
+        entry = directory[offset:offset + 12]
+        try:
+            tag, length, start = entry[:3].decode('ascii'), int(entry[3:7]), int(entry[7:12])
+        except ValueError:
+            raise InvalidRecord('invalid MARC directory')
+        if tag < '010':
+            continue
+        value = data[base + start:base + start + length].rstrip(MARC_FIELD_END)
+        subfields = {}
+        for subfield in value.split(MARC_SUBFIELD)[1:]:
+            code = subfield[:1].decode('ascii', 'replace')
+            subfields.setdefault(code, []).append(subfield[1:].decode('utf-8', 'replace').strip())
+        yield tag, subfields
+
+
+def parse_marc(data):
+    record = {'genres': []}
+    for tag, subfields in marc_fields(data):
+        if tag == '245' and 'title' not in record:
+            record['title'] = ' '.join(subfields.get('a', []) + subfields.get('b', [])).rstrip(' /:;,.')
+        elif tag == '100' and 'author' not in record:
+            record['author'] = ' '.join(subfields.get('a', [])).rstrip(' ,.')
+        elif tag == '520' and 'summary' not in record:
+            record['summary'] = ' '.join(subfields.get('a', []))
+        elif tag == '020' and 'isbn' not in record and ''.join(subfields.get('a', [])).split():
+            # "0306406152 (pbk.)": the qualifier follows the number.
+            record['isbn'] = subfields['a'][0].split()[0]
+        elif tag == '650':
+            record['genres'].extend(name.rstrip(' .') for name in subfields.get('a', []))
+    return record
+
+
+FORMATS = {
+    'csv': (read_csv, dict),
+    'jsonl': (read_jsonl, parse_json),
+    'marc': (read_marc, parse_marc),
+}
+
+
+def split_name(name):
+    if ',' in name:
+        last, _, first = name.partition(',')
+    else:
+        first, _, last = name.strip().rpartition(' ')
+    return first.strip()[:100], last.strip()[:100]
+
+
+def clean(record, default_copies=0):
+    """
+        Normalise a parsed record, raising ``InvalidRecord`` if it cannot be imported.
+    """
+    title = (record.get('title') or '').strip()
+    if not title:
+        raise InvalidRecord('missing title')
+    if len(title) > 200:
+        raise InvalidRecord('title longer than 200 characters')
+
+    isbn = str(record.get('isbn') or '').replace('-', '').replace(' ', '').upper() or None
+    if isbn and len(isbn) > 13:
+        raise InvalidRecord('ISBN %s longer than 13 characters' % isbn)
+
+    genres = record.get('genres') or []
+    if isinstance(genres, str):
+        genres = genres.split(';')
+    genres = sorted({name.strip()[:200] for name in genres if name and name.strip()})
+
+    copies = record.get('copies')
+    try:
+        copies = default_copies if copies in (None, '') else int(copies)
+    except (TypeError, ValueError):
+        raise InvalidRecord('copies %r is not a number' % copies)
+    if copies < 0:
+        raise InvalidRecord('copies %r is negative' % copies)
+
+    author = (record.get('author') or '').strip()
+    return {
+        'title': title,
+        'author': split_name(author) if author else None,
+        'summary': (record.get('summary') or '').strip(),
+        'isbn': isbn,
+        'genres': genres,
+        'copies': copies,
+    }
+
+
+class Importer:
+    """
+        Writes cleaned records in batches, keeping the author and genre lookups
+        and the running totals between batches.
+    """
+    def __init__(self, batch_size=500, copy_status=BookInstance.STATUS_AVAILABLE):
+        self.batch_size = batch_size
+        self.copy_status = copy_status
+        self.authors = {(first, last): pk for pk, first, last in
+                        Author.objects.order_by().values_list('pk', 'first_name', 'last_name').iterator()}
+        self.genres = {name: pk for pk, name in Genre.objects.order_by().values_list('pk', 'name').iterator()}
+        self.totals = {'books': 0, 'authors': 0, 'genres': 0, 'copies': 0, 'duplicates': 0}
+
+    def run(self, records, progress=None):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+                if progress:
+                    progress(self.totals)
+        if batch:
+            self.write(batch)
+        fragments.bump(Book)
+        fragments.bump(Author)
+        fragments.bump(Genre)
+        return self.totals
+
+    def write(self, batch):
+        with transaction.atomic():
+            batch = self.without_duplicates(batch)
+            self.create_lookups(Author, self.authors, {record['author'] for record in batch if record['author']},
+                                lambda key: Author(first_name=key[0], last_name=key[1]),
+                                lambda author: (author.first_name, author.last_name))
+            self.create_lookups(Genre, self.genres, {name for record in batch for name in record['genres']},
+                                lambda name: Genre(name=name), lambda genre: genre.name)
+
+            available = self.copy_status == BookInstance.STATUS_AVAILABLE
+            books = self.bulk_insert(Book, [
+                Book(title=record['title'], summary=record['summary'], isbn=record['isbn'],
+                     author_id=self.authors.get(record['author']), copies_total=record['copies'],
+                     copies_available=record['copies'] if available else 0)
+                for record in batch])
+            Book.genre.through.objects.bulk_create([
+                Book.genre.through(book_id=book.pk, genre_id=self.genres[name])
+                for book, record in zip(books, batch) for name in record['genres']])
+            copies = [BookInstance(book_id=book.pk, status=self.copy_status)
+                      for book, record in zip(books, batch) for _ in range(record['copies'])]
+            BookInstance.objects.bulk_create(copies, batch_size=self.batch_size)
+
+            stats.adjust(CatalogCounter.BOOKS, len(books))
+            stats.adjust(CatalogCounter.INSTANCES, len(copies))
+            stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, len(copies) if available else 0)
+            for book_ids in chunks(book.pk for book in books):
+                search.index_books(book_ids)
+        self.totals['books'] += len(books)
+        self.totals['copies'] += len(copies)
+
+    def without_duplicates(self, batch):
+        # A record is keyed by its ISBN, or by its title and author without one.
+        existing = set()
+        for part in chunks({record['isbn'] for record in batch if record['isbn']}):
+            existing.update(Book.objects.filter(isbn__in=part).values_list('isbn', flat=True))
+        for part in chunks({record['title'] for record in batch if not record['isbn']}):
+            books = (Book.objects.filter(isbn__isnull=True, title__in=part)
+                     .values_list('title', 'author__first_name', 'author__last_name'))
+            existing.update((title, None if last is None else (first, last)) for title, first, last in books)
+        unique = []
+        for record in batch:
+            key = record['isbn'] or (record['title'], record['author'])
+            if key in existing:
+                self.totals['duplicates'] += 1
+                continue
+            existing.add(key)
+            unique.append(record)
+        return unique
+
+    def create_lookups(self, model, lookup, keys, make, key_of):
+        missing = sorted(keys - set(lookup))
+        if not missing:
+            return
+        for instance in self.bulk_insert(model, [make(key) for key in missing]):
+            lookup[key_of(instance)] = instance.pk
+        if model is Author:
+            stats.adjust(CatalogCounter.AUTHORS, len(missing))
+        self.totals[model._meta.model_name + 's'] += len(missing)
+
+    def bulk_insert(self, model, objects):
+        """
+            ``bulk_create`` that sets the primary keys of ``objects`` on every database.
+        """
+        if not objects:
+            return objects
+        # Only Postgres returns the new keys; elsewhere read back the rows added
+        # after the previous maximum, in insertion order. This assumes nothing
+        # else inserts into the table during the batch.
+        max_before = model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        if objects[0].pk is None:
+            new_ids = model.objects.filter(pk__gt=max_before).order_by('pk').values_list('pk', flat=True)
+            for instance, pk in zip(objects, new_ids):
+                instance.pk = pk
+        return objects
+
+
+def read(path, fmt=None, default_copies=0, errors=None):
+    """
+        Yield the cleaned records of ``path``, passing ``(number, message)`` of
+        every record that cannot be imported to ``errors``.
+    """
+    reader, parse = FORMATS[fmt or detect_format(path)]
+    for number, raw in reader(path):
+        try:
+            yield clean(parse(raw), default_copies)
+        except InvalidRecord as exc:
+            if errors:
+                errors(number, str(exc))
+
+
+def import_file(path, fmt=None, batch_size=500, default_copies=0, copy_status=BookInstance.STATUS_AVAILABLE,
+                errors=None, progress=None):
+    """
+        Import every record of ``path`` and return the number of rows created per model.
+    """
+    importer = Importer(batch_size=batch_size, copy_status=copy_status)
+    return importer.run(read(path, fmt, default_copies, errors), progress)
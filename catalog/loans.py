@@ -0,0 +1,112 @@
+"""
+    Loan engine.
+
+    Every change of a copy's loan status is a single conditional ``UPDATE``
+    that only matches rows still in the expected status, so when several
+    patrons go for the same copy at once exactly one of them wins and the
+    others get ``LoanConflict``. Only the loan columns are written; the
+    catalog counters and the book's availability columns are updated in the
+    same transaction. A returned copy is held for the next patron in the
+    book's reservation queue, if there is one (see ``catalog.reservations``).
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from catalog import reservations, stats
+from catalog.models import BookInstance, CatalogCounter, Reservation
+
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+# Copies tried per round when the database cannot skip locked rows.
+CLAIM_BATCH = 10
+
+
+class LoanConflict(Exception):
+    pass
+
+
+def copy_book(copy_id):
+    return BookInstance.objects.filter(pk=copy_id).values_list('book_id', flat=True)
+
+
+def borrow(copy_id, user, due_back=None):
+    """
+        Lend an available copy to ``user`` and return its due date.
+    """
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    with transaction.atomic():
+        claimed = (BookInstance.objects.filter(pk=copy_id, status=BookInstance.STATUS_AVAILABLE)
+                   .update(status=BookInstance.STATUS_ON_LOAN, borrower=user, due_back=due_back))
+        if not claimed:
+            raise LoanConflict('Copy %s is not available' % copy_id)
+        stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, -1)
+        stats.refresh_books(copy_book(copy_id))
+    return due_back
+
+
+def borrow_any(book_id, user, due_back=None):
+    """
+        Lend ``user`` any available copy of a book and return the copy's id.
+
+        Where the database supports ``SKIP LOCKED`` concurrent patrons each lock
+        a different copy instead of queueing behind the first one. Elsewhere
+        (SQLite serialises writers anyway) the candidates are claimed in turn.
+    """
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    available = BookInstance.objects.filter(book_id=book_id, status=BookInstance.STATUS_AVAILABLE).order_by('pk')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            copy_id = available.select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            if copy_id is None:
+                raise LoanConflict('No copy of book %s is available' % book_id)
+            borrow(copy_id, user, due_back)
+        return copy_id
+
+    while True:
+        candidates = list(available.values_list('pk', flat=True)[:CLAIM_BATCH])
+        if not candidates:
+            raise LoanConflict('No copy of book %s is available' % book_id)
+        for copy_id in candidates:
+            try:
+                borrow(copy_id, user, due_back)
+            except LoanConflict:
+                continue
+            return copy_id
+
+
+def return_copy(copy_id, borrower=None):
+    """
+        Check an on-loan copy back in, optionally only if ``borrower`` has it.
+    """
+    copies = BookInstance.objects.filter(pk=copy_id, status=BookInstance.STATUS_ON_LOAN)
+    if borrower is not None:
+        copies = copies.filter(borrower=borrower)
+    with transaction.atomic():
+        if not copies.update(status=BookInstance.STATUS_AVAILABLE, borrower=None, due_back=None):
+            raise LoanConflict('Copy %s is not on loan' % copy_id)
+        book_id = copy_book(copy_id).first()
+        if book_id is None or reservations.assign(copy_id, book_id) is None:
+            stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, 1)
+        stats.refresh_books([book_id])
+
+
+def borrow_held(reservation_id, user, due_back=None):
+    """
+        Lend ``user`` the copy held for their reservation and return the copy's id.
+    """
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    with transaction.atomic():
+        ready = Reservation.objects.filter(pk=reservation_id, user=user, status=Reservation.STATUS_READY,
+                                           expires_at__gt=timezone.now())
+        if not ready.update(status=Reservation.STATUS_FULFILLED):
+            raise LoanConflict('Reservation %s is not ready for collection' % reservation_id)
+        copy_id = Reservation.objects.filter(pk=reservation_id).values_list('copy_id', flat=True).get()
+        claimed = (BookInstance.objects.filter(pk=copy_id, status=BookInstance.STATUS_RESERVED, borrower=user)
+                   .update(status=BookInstance.STATUS_ON_LOAN, due_back=due_back))
+        if not claimed:
+            raise LoanConflict('Copy %s is no longer held for reservation %s' % (copy_id, reservation_id))
+        stats.refresh_books(copy_book(copy_id))
+    return copy_id
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from catalog import storage
+from catalog.models import StoredFile
+
+
+class Command(BaseCommand):
+    help = ('Move media files uploaded before content-addressed storage to their content-addressed '
+            'names, merging duplicates, and point the rows at them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', action='store_true', help='Leave the legacy files in place.')
+
+    def handle(self, *args, **options):
+        cas = storage.content_addressed_storage
+        adopted, freed = 0, 0
+        stored = set(StoredFile.objects.values_list('name', flat=True))
+        for model, fields in storage.file_fields().items():
+            for field_name in fields:
+                field = model._meta.get_field(field_name)
+                names = (model.objects.exclude(**{field_name + '__startswith': storage.PREFIX + '/'})
+                         .exclude(**{field_name + '__in': ['', field.default]})
+                         .order_by().values_list(field_name, flat=True).distinct())
+                for name in list(names):
+                    if not name or not cas.exists(name):
+                        continue
+                    with cas.open(name, 'rb') as legacy:
+                        new_name = cas.save(name, legacy)
+                    model.objects.filter(**{field_name: name}).update(**{field_name: new_name})
+                    adopted += 1
+                    if not options['keep']:
+                        # A file whose content was already stored is freed, any other one is moved.
+                        if new_name in stored:
+                            freed += cas.size(name)
+                        cas.delete(name)
+                    stored.add(new_name)
+                    self.stdout.write('%s -> %s' % (name, new_name))
+
+        storage.reconcile()
+        self.stdout.write(self.style.SUCCESS('Adopted %d files, freed %d bytes' % (adopted, freed)))
@@ -0,0 +1,172 @@
+import json
+import math
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, reverse
+
+from catalog import delivery
+from catalog import urls as catalog_urls
+from catalog.models import Author, Book, BookInstance, Reservation
+
+# URL names that need a staff member rather than a patron.
+STAFF_URLS = {
+    'dashboard_staff', 'renew-book-librarian',
+    'author_create', 'author_update', 'author_delete',
+    'book_create', 'book_update', 'book_delete', 'export_catalog', 'bulk_copies',
+}
+
+# URL names whose arguments do not come from the fixtures.
+URL_KWARGS = {
+    'export_catalog': {'kind': 'books', 'fmt': 'csv'},
+    'bulk_copies': {'action': 'checkin'},
+}
+
+# URL names exercised with a POST, mapped to the form data built from the fixtures.
+POST_DATA = {
+    'email_book': lambda fixtures: {'book_id': fixtures['book'].pk},
+    'borrow_book': lambda fixtures: {},
+    'borrow_any_copy': lambda fixtures: {},
+    'reserve_book': lambda fixtures: {},
+    'collect_reservation': lambda fixtures: {},
+    'cancel_reservation': lambda fixtures: {},
+    'bulk_copies': lambda fixtures: {},
+    'customer_login': lambda fixtures: {'customer_username': fixtures['patron'].username,
+                                        'customer_password': fixtures['password']},
+}
+
+# Query strings for GET scenarios that need one.
+QUERY_DATA = {
+    'search_book': lambda fixtures: {'q': fixtures['book'].title.split()[-1]},
+    'search_author': lambda fixtures: {'q': fixtures['author'].last_name.split()[0]},
+}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(share * len(ordered))) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Request every URL of the catalog app through the test client and report p50/p95 '
+            'latency and query counts per view as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+        ):
+            with transaction.atomic():
+                report = self.run(options['iterations'])
+                # Leave the benchmark users and every write made by the views behind.
+                transaction.set_rollback(True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def fixtures(self):
+        book = Book.objects.filter(bookinstance__isnull=False).order_by('pk').first()
+        author = Author.objects.filter(book__isnull=False).order_by('pk').first()
+        if book is None or author is None:
+            raise CommandError('The catalog is empty, run generate_catalog first.')
+        password = 'benchmark-%d' % time.time()
+        patron = User.objects.create_user(username='benchmark_patron', password=password,
+                                          email='benchmark_patron@example.com')
+        staff = User.objects.create_superuser(username='benchmark_staff', password=password,
+                                              email='benchmark_staff@example.com')
+        on_loan = BookInstance.objects.filter(book=book).first()
+        on_loan.status, on_loan.borrower = BookInstance.STATUS_ON_LOAN, patron
+        on_loan.save()
+        available = BookInstance.objects.create(book=book, status=BookInstance.STATUS_AVAILABLE)
+        reservation = Reservation.objects.create(book=book, user=patron, position=1)
+        return {
+            'book': book, 'author': author, 'patron': patron, 'staff': staff, 'password': password,
+            'on_loan': on_loan, 'available': available, 'reservation': reservation,
+            'download_token': delivery.create_link(book, patron),
+        }
+
+    def url_kwargs(self, pattern, fixtures):
+        if pattern.name in URL_KWARGS:
+            return dict(URL_KWARGS[pattern.name])
+        kwargs = {}
+        for name, converter in pattern.pattern.converters.items():
+            if pattern.name == 'download_link':
+                kwargs[name] = fixtures['download_token']
+            elif type(converter).__name__ == 'UUIDConverter':
+                copy = fixtures['available'] if pattern.name == 'borrow_book' else fixtures['on_loan']
+                kwargs[name] = copy.pk
+            elif pattern.name.endswith('_reservation'):
+                kwargs[name] = fixtures['reservation'].pk
+            elif pattern.name.startswith('author'):
+                kwargs[name] = fixtures['author'].pk
+            else:
+                kwargs[name] = fixtures['book'].pk
+        return kwargs
+
+    def run(self, iterations):
+        fixtures = self.fixtures()
+        client = Client()
+        views = {}
+        for pattern in catalog_urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name:
+                continue
+            path = reverse(pattern.name, kwargs=self.url_kwargs(pattern, fixtures))
+            if pattern.name in POST_DATA:
+                method, data = 'post', POST_DATA[pattern.name](fixtures)
+            else:
+                method, data = 'get', QUERY_DATA.get(pattern.name, dict)(fixtures)
+            user = fixtures['staff'] if pattern.name in STAFF_URLS else fixtures['patron']
+
+            timings, queries, status = [], [], None
+            try:
+                for _ in range(iterations):
+                    client.force_login(user)
+                    with transaction.atomic():
+                        with CaptureQueriesContext(connection) as captured:
+                            started = time.perf_counter()
+                            response = getattr(client, method)(path, data)
+                            timings.append((time.perf_counter() - started) * 1000)
+                        transaction.set_rollback(True)
+                    queries.append(len(captured))
+                    status = response.status_code
+            except Exception as exc:
+                views[pattern.name] = {'path': path, 'method': method.upper(), 'error': repr(exc)}
+                continue
+
+            views[pattern.name] = {
+                'path': path,
+                'method': method.upper(),
+                'status': status,
+                'p50_ms': round(percentile(timings, 0.5), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'queries': int(statistics.median(queries)),
+                'max_queries': max(queries),
+            }
+
+        return {
+            'database': connection.vendor,
+            'iterations': iterations,
+            'catalog': {
+                'books': Book.objects.count(),
+                'authors': Author.objects.count(),
+                'copies': BookInstance.objects.count(),
+            },
+            'views': views,
+        }
@@ -0,0 +1,81 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from catalog import loans
+from catalog.management.commands.benchmark_catalog import percentile
+from catalog.models import Book, BookInstance, Reservation
+
+
+class Command(BaseCommand):
+    help = ('Time the check-in of a copy wanted by a reservation queue at several queue lengths and '
+            'report p50/p95 latency and query counts per length as JSON. Handing the copy to the head '
+            'of the queue should cost the same at every length.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', default='10,100,1000,10000',
+                            help='Comma separated queue lengths to measure.')
+        parser.add_argument('--returns', type=int, default=20, help='Check-ins timed per queue length.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            lengths = sorted({int(length) for length in options['lengths'].split(',')})
+        except ValueError:
+            raise CommandError('--lengths must be comma separated numbers')
+        returns = options['returns']
+        if returns < 1:
+            raise CommandError('--returns must be at least 1')
+        if lengths[0] < returns:
+            raise CommandError('Every queue must be at least --returns long, so each check-in has a patron to serve')
+
+        with transaction.atomic():
+            report = {
+                'database': connection.vendor,
+                'returns': returns,
+                'queues': {str(length): self.measure(length, returns) for length in lengths},
+            }
+            # Leave none of the benchmark books, patrons or reservations behind.
+            transaction.set_rollback(True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def queue(self, length):
+        book = Book.objects.create(title='Reservation benchmark %d' % length, summary='Benchmark')
+        copy = BookInstance.objects.create(book=book, status=BookInstance.STATUS_ON_LOAN)
+        prefix = 'benchmark_reserver_%d_' % length
+        User.objects.bulk_create([User(username='%s%d' % (prefix, number), email='%s%d@example.com' % (prefix, number))
+                                  for number in range(length)], batch_size=500)
+        user_ids = User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True)
+        Reservation.objects.bulk_create([Reservation(book=book, user_id=user_id, position=position)
+                                         for position, user_id in enumerate(user_ids, 1)], batch_size=500)
+        return copy
+
+    def measure(self, length, returns):
+        copy = self.queue(length)
+        on_loan = BookInstance.objects.filter(pk=copy.pk)
+        timings, queries = [], []
+        for _ in range(returns):
+            on_loan.update(status=BookInstance.STATUS_ON_LOAN, borrower=None, due_back=timezone.localdate())
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                loans.return_copy(copy.pk)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'queries': int(statistics.median(queries)),
+            'max_queries': max(queries),
+        }
@@ -0,0 +1,68 @@
+import datetime
+import json
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import bulk
+
+
+class Command(BaseCommand):
+    help = ('Check copies in or out, or send them to maintenance, in chunked transactions. The copies are '
+            'read one id per line from a file, or selected with a filter such as "status=o&due_back__lt=2024-01-31".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=list(bulk.TRANSITIONS))
+        parser.add_argument('--ids', help='File of copy ids, one per line; "-" reads standard input.')
+        parser.add_argument('--filter', help='Query-string expression selecting the copies instead of --ids.')
+        parser.add_argument('--borrower', help='Username the copies are checked out to.')
+        parser.add_argument('--due-back', help='Due date of the copies checked out, YYYY-MM-DD.')
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE, help='Copies per transaction.')
+        parser.add_argument('--report', help='Write the result of every copy to this file as JSON Lines.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        borrower = None
+        if options['borrower']:
+            borrower = User.objects.filter(username=options['borrower']).first()
+            if borrower is None:
+                raise CommandError('No user %r' % options['borrower'])
+        due_back = None
+        if options['due_back']:
+            try:
+                due_back = datetime.datetime.strptime(options['due_back'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--due-back must be a YYYY-MM-DD date')
+
+        source = None
+        if options['ids']:
+            source = sys.stdin if options['ids'] == '-' else open(options['ids'], encoding='utf-8')
+        report = open(options['report'], 'w') if options['report'] else None
+        started = time.perf_counter()
+        summary = {}
+        try:
+            results = bulk.apply(options['action'], ids=source, where=options['filter'], borrower=borrower,
+                                 due_back=due_back, chunk_size=options['chunk_size'])
+            for value, result, status in results:
+                summary[result] = summary.get(result, 0) + 1
+                if report:
+                    report.write(json.dumps({'id': value, 'result': result, 'status': status}) + '\n')
+                elif result in (bulk.CONFLICT, bulk.NOT_FOUND, bulk.INVALID):
+                    self.stderr.write('%s: %s%s' % (value, result, ' (status %s)' % status if status else ''))
+        except bulk.BulkError as exc:
+            raise CommandError(exc)
+        finally:
+            if source not in (None, sys.stdin):
+                source.close()
+            if report:
+                report.close()
+        elapsed = time.perf_counter() - started
+
+        total = sum(summary.values())
+        self.stdout.write(', '.join('%d %s' % (count, result) for result, count in sorted(summary.items()))
+                          or 'No copies selected')
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS('Processed %d copies in %.2fs (%.0f copies/s)' % (total, elapsed, rate)))
@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from catalog import dataset
+from catalog.models import Author, Book, BookInstance
+
+# Indexes added by migration 0020 that the "before" run drops.
+CATALOG_INDEXES = (
+    'catalog_author_name_idx',
+    'catalog_bi_status_due_idx',
+    'catalog_bi_borrower_idx',
+    'catalog_bi_due_back_idx',
+    'catalog_bi_on_loan_due_idx',
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Show query plans and timings of the hot catalog queries with and without the '
+            'catalog indexes, optionally seeding a large dataset first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-copies', type=int, default=0,
+                            help='Bulk create this many book copies (plus books, authors and borrowers) first.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows built in memory per bulk insert while seeding.')
+
+    def handle(self, *args, **options):
+        if options['seed_copies']:
+            self.seed(options['seed_copies'], options['batch_size'])
+
+        borrower_id = (BookInstance.objects.filter(status=BookInstance.STATUS_ON_LOAN)
+                       .values_list('borrower_id', flat=True).first())
+        queries = [
+            ('available copies (index count)',
+             lambda: BookInstance.objects.filter(status=BookInstance.STATUS_AVAILABLE).order_by(), 'count'),
+            ('loans by due date (staff dashboard)',
+             lambda: BookInstance.objects.filter(status=BookInstance.STATUS_ON_LOAN).order_by('due_back')[:5], 'list'),
+            ('loans of one borrower (customer dashboard)',
+             lambda: BookInstance.objects.filter(borrower_id=borrower_id, status=BookInstance.STATUS_ON_LOAN).order_by('due_back'), 'list'),
+            ('books by title (book list)', lambda: Book.objects.order_by('title')[:3], 'list'),
+            ('authors by name (author list)', lambda: Author.objects.order_by('last_name', 'first_name')[:3], 'list'),
+        ]
+
+        before = self.measure_without_indexes(queries, options['repeat'])
+        after = self.measure(queries, options['repeat'])
+        for label, factory, kind in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for name, results in (('before', before), ('after', after)):
+                plan, elapsed = results[label]
+                self.stdout.write('  %s: %.2f ms' % (name, elapsed))
+                for line in plan.splitlines():
+                    self.stdout.write('    ' + line)
+
+    def measure(self, queries, repeat):
+        results = {}
+        for label, factory, kind in queries:
+            plan = factory().explain()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if kind == 'count':
+                    factory().count()
+                else:
+                    list(factory())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = (plan, statistics.median(timings))
+        return results
+
+    def measure_without_indexes(self, queries, repeat):
+        index_names = list(CATALOG_INDEXES) + self.title_indexes()
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for name in index_names:
+                        cursor.execute('DROP INDEX IF EXISTS %s' % connection.ops.quote_name(name))
+                results = self.measure(queries, repeat)
+                raise Rollback
+        except Rollback:
+            return results
+
+    def title_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Book._meta.db_table)
+        return [name for name, details in constraints.items()
+                if details['index'] and not details['unique'] and details['columns'] == ['title']]
+
+    def seed(self, copies, batch_size):
+        started = time.perf_counter()
+        created = dataset.generate(authors=max(copies // 100, 1), books=max(copies // 10, 1), copies=copies,
+                                   users=max(copies // 1000, 1), batch_size=batch_size)
+        self.stdout.write('Seeded %(copies)d copies of %(books)d books' % created +
+                          ' in %.1fs' % (time.perf_counter() - started))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import stats
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = ('Compare the availability columns of every book with its copies and repair the books '
+            'that drifted, a batch at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted books.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        expected = {'expected_' + name: column for name, column in stats.availability_columns().items()}
+        checked, drifted, last_pk = 0, 0, 0
+        while True:
+            rows = list(Book.objects.filter(pk__gt=last_pk).order_by('pk').annotate(**expected)
+                        .values_list('pk', *Book.AVAILABILITY_FIELDS, *expected)[:options['batch_size']])
+            if not rows:
+                break
+            width = len(Book.AVAILABILITY_FIELDS)
+            stale = [row[0] for row in rows if row[1:1 + width] != row[1 + width:]]
+            if stale:
+                self.stdout.write('Drifted: %s' % ', '.join(str(pk) for pk in stale))
+                if not options['dry_run']:
+                    stats.refresh_books(stale)
+            checked += len(rows)
+            drifted += len(stale)
+            last_pk = rows[-1][0]
+
+        verb = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS('Checked %d books, %s %d' % (checked, verb, drifted)))
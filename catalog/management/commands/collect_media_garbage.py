@@ -0,0 +1,25 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from catalog import storage
+
+
+class Command(BaseCommand):
+    help = ('Recount references to content-addressed media files and delete the files no book, '
+            'author or profile uses any more.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep unreferenced files younger than this, they may belong to an upload in progress.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be deleted.')
+
+    def handle(self, *args, **options):
+        storage.reconcile()
+        collected = storage.collect_garbage(datetime.timedelta(hours=options['grace_hours']),
+                                            dry_run=options['dry_run'])
+        for name, size in collected:
+            self.stdout.write('%s (%d bytes)' % (name, size))
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS('%s %d files, %d bytes' % (
+            verb, len(collected), sum(size for name, size in collected))))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import reservations
+
+
+class Command(BaseCommand):
+    help = ('Expire the reservation holds not collected in time and pass each held copy on to the '
+            'next patron in line, or back to the shelf.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Holds expired per transaction.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        expired = reservations.expire_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Expired %d holds' % expired))
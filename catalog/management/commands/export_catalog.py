@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import exporter
+
+
+class Command(BaseCommand):
+    help = 'Stream the books, authors or copies of the catalog to a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exporter.EXPORTS))
+        parser.add_argument('--format', default='csv', choices=sorted(exporter.FORMATS))
+        parser.add_argument('--output', help='Write to this file instead of stdout.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--chunk-size', type=int, default=exporter.CHUNK_SIZE,
+                            help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        started = time.perf_counter()
+        chunks = exporter.export(options['kind'], options['format'], options['gzip'], options['chunk_size'])
+        written = 0
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+                    written += len(chunk)
+            self.stdout.write(self.style.SUCCESS('Wrote %d bytes to %s in %.1fs' % (
+                written, options['output'], time.perf_counter() - started)))
+        elif options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            # Every chunk ends on a whole row, so it decodes on its own.
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import dataset
+
+
+def status_mix(value):
+    mix = {}
+    for part in value.split(','):
+        status, _, weight = part.partition('=')
+        mix[status.strip()] = int(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = 'Bulk generate a synthetic library (authors, genres, books, copies, patrons) for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--genres', type=int, default=30)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--copies', type=int, default=50000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--status-mix', type=status_mix, default=None,
+                            help='Relative share of copy statuses, e.g. "a=50,o=35,m=10,r=5".')
+        parser.add_argument('--overdue-share', type=float, default=0.2,
+                            help='Fraction of on-loan copies whose due date has passed.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible dataset.')
+        parser.add_argument('--password', default=dataset.DEFAULT_PASSWORD, help='Password of the generated patrons.')
+
+    def handle(self, *args, **options):
+        mix = options['status_mix']
+        if mix and not set(mix) <= set(dataset.DEFAULT_STATUS_MIX):
+            raise CommandError('Unknown status in --status-mix: %s' % ', '.join(sorted(set(mix) - set(dataset.DEFAULT_STATUS_MIX))))
+
+        started = time.perf_counter()
+        created = dataset.generate(
+            authors=options['authors'], genres=options['genres'], books=options['books'],
+            copies=options['copies'], users=options['users'], status_mix=mix,
+            overdue_share=options['overdue_share'], batch_size=options['batch_size'],
+            seed=options['seed'], password=options['password'],
+        )
+        elapsed = time.perf_counter() - started
+        for name, count in created.items():
+            self.stdout.write('%s: %d' % (name, count))
+        self.stdout.write(self.style.SUCCESS('Generated %d rows in %.1fs' % (sum(created.values()), elapsed)))
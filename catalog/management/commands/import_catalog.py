@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import importer
+from catalog.models import BookInstance
+
+# Invalid records reported one by one; the rest are only counted.
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = ('Stream books from a CSV, JSON Lines or MARC21 file into the catalog, creating their authors, '
+            'genres and copies in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(importer.FORMATS),
+                            help='File format, guessed from the extension by default.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Records written per transaction.')
+        parser.add_argument('--copies', type=int, default=0,
+                            help='Copies created for records that do not give a number of copies.')
+        # New copies have no borrower, so they can only be on the shelf or in maintenance.
+        parser.add_argument('--copy-status', default=BookInstance.STATUS_AVAILABLE,
+                            choices=[BookInstance.STATUS_AVAILABLE, BookInstance.STATUS_MAINTENANCE],
+                            help='Status of the created copies.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or importer.detect_format(options['path'])
+        if fmt is None:
+            raise CommandError('Cannot tell the format of %s, pass --format' % options['path'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['copies'] < 0:
+            raise CommandError('--copies cannot be negative')
+
+        invalid = []
+
+        def report_error(number, message):
+            invalid.append(number)
+            if len(invalid) <= MAX_REPORTED_ERRORS:
+                self.stderr.write('Record %d skipped: %s' % (number, message))
+
+        started = time.perf_counter()
+
+        def report_progress(totals):
+            if options['verbosity'] >= 2:
+                self.stdout.write('%(books)d books, %(copies)d copies' % totals +
+                                  ' (%.0f books/s)' % (totals['books'] / (time.perf_counter() - started)))
+
+        try:
+            totals = importer.import_file(options['path'], fmt, batch_size=options['batch_size'],
+                                          default_copies=options['copies'], copy_status=options['copy_status'],
+                                          errors=report_error, progress=report_progress)
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        elapsed = time.perf_counter() - started
+
+        for name, count in totals.items():
+            self.stdout.write('%s: %d' % (name, count))
+        if invalid:
+            self.stdout.write('invalid: %d' % len(invalid))
+        records = totals['books'] + totals['duplicates'] + len(invalid)
+        self.stdout.write(self.style.SUCCESS('Imported %d of %d records in %.1fs (%.0f records/s)' % (
+            totals['books'], records, elapsed, records / elapsed if elapsed else 0)))
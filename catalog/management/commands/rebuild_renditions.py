@@ -0,0 +1,129 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files.storage import default_storage
+from django.db.models.fields.files import FieldFile
+
+from catalog import images
+
+
+def render_image(label, field_name, name, force):
+    """
+        Make every rendition of one stored image; runs in a worker process.
+    """
+    field = apps.get_model(label)._meta.get_field(field_name)
+    image = FieldFile(None, field, name)
+    try:
+        images.make_all_renditions(image, force=force)
+        detail = images.rendition_name(images.source_digest(image), 'detail', 1, 'jpeg')
+        return name, (image.storage.size(name), default_storage.size(detail)), None
+    except (OSError, ValueError) as exc:
+        return name, None, repr(exc)
+
+
+class InlineExecutor(Executor):
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+class Command(BaseCommand):
+    help = ('Regenerate the renditions of every book cover, author portrait and profile picture on a '
+            'pool of worker processes. Progress is checkpointed so an interrupted run can resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 0 renders in this process.')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Rows read and checkpointed at a time.')
+        parser.add_argument('--checkpoint', default='.renditions-checkpoint.json',
+                            help='File recording the last processed row of each model.')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+        parser.add_argument('--force', action='store_true', help='Re-encode renditions that already exist.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--workers must not be negative and --chunk-size must be at least 1')
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = {} if options['restart'] else self.load_checkpoint()
+        self.force = options['force']
+        self.totals = {'images': 0, 'failed': 0, 'source_bytes': 0, 'served_bytes': 0}
+        self.seen = set()
+        started = time.perf_counter()
+
+        if options['workers']:
+            # Spawned rather than forked, so workers never inherit the parent's database connections.
+            pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=django.setup)
+        else:
+            pool = InlineExecutor()
+        with pool:
+            for model, fields in images.IMAGE_FIELDS.items():
+                self.process_model(pool, model, fields, options['chunk_size'])
+
+        elapsed = time.perf_counter() - started
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            'Rendered %d images in %.1fs (%.1f images/sec), %d failed' % (
+                totals['images'], elapsed, totals['images'] / elapsed if elapsed else 0, totals['failed'])))
+        self.stdout.write('Originals %d bytes, detail renditions %d bytes, %d bytes saved per full view' % (
+            totals['source_bytes'], totals['served_bytes'], totals['source_bytes'] - totals['served_bytes']))
+
+    def process_model(self, pool, model, fields, chunk_size):
+        label = model._meta.label
+        rows = (model.objects.filter(pk__gt=self.checkpoint.get(label, 0)).order_by('pk')
+                .values_list('pk', *fields).iterator(chunk_size=chunk_size))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                self.process_chunk(pool, label, fields, chunk)
+                chunk = []
+        if chunk:
+            self.process_chunk(pool, label, fields, chunk)
+
+    def process_chunk(self, pool, label, fields, rows):
+        jobs = []
+        for pk, *names in rows:
+            for field_name, name in zip(fields, names):
+                # Many rows share the default picture; render each file once.
+                if name and name not in self.seen:
+                    self.seen.add(name)
+                    jobs.append(pool.submit(render_image, label, field_name, name, self.force))
+
+        for job in jobs:
+            name, result, error = job.result()
+            if error:
+                self.totals['failed'] += 1
+                self.stderr.write('%s: %s' % (name, error))
+                continue
+            source_bytes, detail_bytes = result
+            self.totals['images'] += 1
+            self.totals['source_bytes'] += source_bytes
+            self.totals['served_bytes'] += min(source_bytes, detail_bytes)
+
+        self.checkpoint[label] = rows[-1][0]
+        self.save_checkpoint()
+        self.stdout.write('%s: up to id %s, %d images so far' % (label, rows[-1][0], self.totals['images']))
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+        self.stdout.write('Resuming from %s' % self.checkpoint_path)
+        return checkpoint
+
+    def save_checkpoint(self):
+        with open(self.checkpoint_path + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.checkpoint, checkpoint_file)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from catalog import stats
+from catalog.models import CatalogCounter
+
+
+class Command(BaseCommand):
+    help = 'Recount the catalog statistics shown on the index page and repair any drift.'
+
+    def handle(self, *args, **options):
+        stored = dict(CatalogCounter.objects.values_list('name', 'value'))
+        for name, value in sorted(stats.reconcile().items()):
+            drift = value - stored.get(name, 0)
+            self.stdout.write('%s: %d (drift %+d)' % (name, value, drift))
+        self.stdout.write(self.style.SUCCESS('Catalog statistics reconciled'))
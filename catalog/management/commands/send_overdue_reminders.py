@@ -0,0 +1,68 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from catalog import outbox, reminders
+from catalog.models import OverdueReminder
+
+
+class Command(BaseCommand):
+    help = ('Email every borrower with overdue loans one digest listing them, at most once a day, '
+            'and deliver the queued digests over a single mail server connection.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Borrowers queued per transaction, and messages claimed per delivery batch.')
+        parser.add_argument('--queue-only', action='store_true',
+                            help='Only queue the digests, leave delivery to send_queued_email.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be sent, and how fast it was found, without writing anything.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        today = timezone.localdate()
+        started = time.perf_counter()
+        borrowers = loans = queued = 0
+        batch = []
+        for digest in reminders.digests(reminders.overdue_loans(today)):
+            borrowers += 1
+            loans += len(digest.loans)
+            batch.append(digest)
+            if len(batch) >= batch_size:
+                queued += reminders.queue_digests(batch, today, options['dry_run'])
+                batch = []
+        if batch:
+            queued += reminders.queue_digests(batch, today, options['dry_run'])
+        elapsed = time.perf_counter() - started
+
+        verb = 'Would queue' if options['dry_run'] else 'Queued'
+        self.stdout.write('%s %d digests for %d borrowers with %d overdue loans' % (verb, queued, borrowers, loans))
+        if options['dry_run']:
+            rate = loans / elapsed if elapsed else 0
+            self.stdout.write('Scanned in %.2fs (%.0f loans/s)' % (elapsed, rate))
+            return
+        if not options['queue_only']:
+            self.stdout.write(self.style.SUCCESS('Sent %d messages' % self.deliver(batch_size, today)))
+
+    def deliver(self, batch_size, today):
+        connection = get_connection()
+        try:
+            connection.open()
+        except OSError as exc:
+            raise CommandError('Cannot reach the mail server, the digests stay queued: %s' % exc)
+        # Only today's digests: the rest of the outbox is send_queued_email's.
+        digests = OverdueReminder.objects.filter(sent_on=today, email__isnull=False).values('email_id')
+        sent = 0
+        try:
+            while True:
+                emails = outbox.claim(batch_size, among=digests)
+                if not emails:
+                    return sent
+                sent += outbox.deliver(emails, connection)
+        finally:
+            connection.close()
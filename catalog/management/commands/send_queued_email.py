@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from catalog import outbox
+
+
+class Command(BaseCommand):
+    help = ('Deliver the queued catalog email. Each worker thread sends a batch over one mail server '
+            'connection; failed messages are retried with backoff.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Batches sent in parallel.')
+        parser.add_argument('--batch-size', type=int, default=20, help='Messages per connection.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once no message is due.')
+
+    def handle(self, *args, **options):
+        workers, batch_size = options['workers'], options['batch_size']
+        if workers < 1 or batch_size < 1:
+            raise CommandError('--workers and --batch-size must be at least 1')
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                emails = outbox.claim(workers * batch_size)
+                if emails:
+                    batches = [emails[start:start + batch_size] for start in range(0, len(emails), batch_size)]
+                    if workers == 1:
+                        sent = sum(map(outbox.deliver, batches))
+                    else:
+                        sent = sum(pool.map(self.deliver, batches))
+                    self.stdout.write('Sent %d of %d messages' % (sent, len(emails)))
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+
+    def deliver(self, emails):
+        try:
+            return outbox.deliver(emails)
+        finally:
+            connections.close_all()
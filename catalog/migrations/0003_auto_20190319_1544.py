@@ -1,17 +0,0 @@
-# Generated by Django 2.1.1 on 2019-03-19 10:14
-
-from django.db import migrations
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('catalog', '0002_bookinstance_borrower'),
-    ]
-
-    operations = [
-        migrations.AlterModelOptions(
-            name='bookinstance',
-            options={'ordering': ['due_back'], 'permissions': (('can_mark_returned', 'Set book as returned'),)},
-        ),
-    ]
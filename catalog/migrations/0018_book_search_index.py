@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from catalog import search
+
+
+def install_search_index(apps, schema_editor):
+    backend = search.get_backend(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.install(cursor)
+    backend.rebuild()
+
+
+def uninstall_search_index(apps, schema_editor):
+    backend = search.get_backend(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.uninstall(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0017_auto_20181221_0452'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
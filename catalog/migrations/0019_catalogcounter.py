@@ -0,0 +1,38 @@
+# Generated by Django 2.1.11 on 2026-10-17 20:33
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_counters(apps, schema_editor):
+    CatalogCounter = apps.get_model('catalog', 'CatalogCounter')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    counts = {
+        'books': apps.get_model('catalog', 'Book').objects.count(),
+        'instances': BookInstance.objects.count(),
+        'instances_available': BookInstance.objects.filter(status='a').count(),
+        'authors': apps.get_model('catalog', 'Author').objects.count(),
+    }
+    now = timezone.now()
+    CatalogCounter.objects.bulk_create(
+        CatalogCounter(name=name, value=value, reconciled_at=now) for name, value in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0018_book_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,131 @@
+# Generated by Django 2.1.11 on 2026-10-17 20:37
+
+from django.db import migrations, models
+from django.db.models import Count
+
+ISBN_HELP_TEXT = '13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>'
+
+# The search index documents as 0018 created them. The SQL is copied here so
+# later changes to catalog.search cannot change what this migration does.
+SEARCH_INDEX_REBUILD = {
+    'sqlite': [
+        "DELETE FROM catalog_book_fts",
+        "INSERT INTO catalog_book_fts (rowid, title, summary, isbn, author, genre) "
+        "SELECT b.id, b.title, b.summary, b.isbn, "
+        "COALESCE(a.first_name || ' ' || a.last_name, ''), "
+        "COALESCE((SELECT group_concat(g.name, ' ') FROM catalog_book_genre bg "
+        "JOIN catalog_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '') "
+        "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id",
+    ],
+    'postgresql': [
+        "TRUNCATE catalog_book_search",
+        "INSERT INTO catalog_book_search (book_id, document) "
+        "SELECT b.id, "
+        "setweight(to_tsvector('simple', coalesce(b.title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(b.isbn, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(a.first_name || ' ' || a.last_name, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce((SELECT string_agg(g.name, ' ') FROM catalog_book_genre bg "
+        "JOIN catalog_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '')), 'C') || "
+        "setweight(to_tsvector('simple', coalesce(b.summary, '')), 'D') "
+        "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id",
+    ],
+}
+
+
+def rebuild_search_index(connection):
+    statements = SEARCH_INDEX_REBUILD.get(connection.vendor)
+    if statements is None:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # Without FTS5 0018 created no index.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'catalog_book_fts'")
+            if cursor.fetchone() is None:
+                return
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def dedupe_isbns(apps, schema_editor):
+    """
+        Make ISBNs unique before the constraint is added.
+
+        Books sharing an ISBN with the same title and author are the same book
+        entered twice: their copies and genres move to the oldest record and the
+        duplicate is deleted. Any other clash keeps the ISBN on the oldest record
+        and clears it on the rest so staff can correct them.
+    """
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    CatalogCounter = apps.get_model('catalog', 'CatalogCounter')
+
+    duplicated = (Book.objects.order_by().values('isbn').annotate(books=Count('id'))
+                  .filter(books__gt=1).values_list('isbn', flat=True))
+    changed = False
+    for isbn in list(duplicated):
+        keeper, *others = Book.objects.filter(isbn=isbn).order_by('id')
+        for book in others:
+            if book.title.lower() == keeper.title.lower() and book.author_id == keeper.author_id:
+                BookInstance.objects.filter(book=book).update(book=keeper)
+                keeper.genre.add(*book.genre.all())
+                book.delete()
+            else:
+                book.isbn = None
+                book.save(update_fields=['isbn'])
+            changed = True
+
+    if changed:
+        CatalogCounter.objects.filter(name='books').update(value=Book.objects.count())
+        rebuild_search_index(schema_editor.connection)
+
+
+def restore_blank_isbns(apps, schema_editor):
+    apps.get_model('catalog', 'Book').objects.filter(isbn__isnull=True).update(isbn='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0019_catalogcounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(help_text=ISBN_HELP_TEXT, max_length=13, null=True),
+        ),
+        migrations.RunPython(dedupe_isbns, restore_blank_isbns),
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(help_text=ISBN_HELP_TEXT, max_length=13, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='title',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['last_name', 'first_name'], name='catalog_author_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['status', 'due_back'], name='catalog_bi_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['borrower', 'status', 'due_back'], name='catalog_bi_borrower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['due_back'], name='catalog_bi_due_back_idx'),
+        ),
+        # Django 2.1 has no Index(condition=...), so the partial index for the
+        # loan dashboards is created by hand. SQLite and Postgres share the syntax.
+        migrations.RunSQL(
+            ["CREATE INDEX catalog_bi_on_loan_due_idx ON catalog_bookinstance (due_back) WHERE status = 'o'"],
+            ["DROP INDEX catalog_bi_on_loan_due_idx"],
+        ),
+    ]
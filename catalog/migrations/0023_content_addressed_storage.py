@@ -0,0 +1,43 @@
+# Generated by Django 2.1.11 on 2026-10-17 20:53
+
+import catalog.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0022_downloadlink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('references', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='author',
+            name='author_profile_picture',
+            field=models.ImageField(blank=True, default='author_images/no_image.png', null=True, storage=catalog.storage.ContentAddressedStorage(), upload_to='author_images/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='file',
+            field=models.FileField(blank=True, default='book_pdf/no_pdf.pdf', null=True, storage=catalog.storage.ContentAddressedStorage(), upload_to='book_pdf/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='picture',
+            field=models.ImageField(blank=True, default='book_images/no_profile_picture.png', null=True, storage=catalog.storage.ContentAddressedStorage(), upload_to='book_images/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, default='author_images/no_image.png', null=True, storage=catalog.storage.ContentAddressedStorage(), upload_to='customer_profile_images/%Y/%m/%d/', verbose_name='Profile Picture'),
+        ),
+    ]
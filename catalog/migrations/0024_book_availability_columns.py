@@ -0,0 +1,47 @@
+# Generated by Django 2.1.11 on 2026-10-17 20:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_availability(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+    def count(queryset):
+        counted = queryset.annotate(copies=Count('pk')).values('copies')
+        return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+    Book.objects.update(
+        copies_total=count(copies),
+        copies_available=count(copies.filter(status='a')),
+        next_due_back=Subquery(copies.filter(status='o').annotate(due=Min('due_back')).values('due')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0023_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='next_due_back',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_availability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.11 on 2026-10-17 21:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0025_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverdueReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sent_on', models.DateField()),
+                ('loans', models.PositiveIntegerField()),
+                ('borrower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('email', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='catalog.OutboundEmail')),
+            ],
+            options={
+                'ordering': ['-sent_on'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='overduereminder',
+            unique_together={('borrower', 'sent_on')},
+        ),
+    ]
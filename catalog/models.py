@@ -1,8 +1,9 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
+from catalog.storage import content_addressed_storage
 import uuid
-from datetime import date
 
 # Create your models here.
 
@@ -14,14 +15,74 @@ class Genre(models.Model):
         return self.name
 
 
+class BookQuerySet(models.QuerySet):
+    def with_availability(self):
+        """
+            Annotate each book with the number of its copies in every loan status
+            and the earliest due date of a copy on loan, in the same query.
+        """
+        def copies(status):
+            return models.Count('bookinstance', filter=models.Q(bookinstance__status=status))
+
+        return self.annotate(
+            num_available=copies(BookInstance.STATUS_AVAILABLE),
+            num_on_loan=copies(BookInstance.STATUS_ON_LOAN),
+            num_reserved=copies(BookInstance.STATUS_RESERVED),
+            num_maintenance=copies(BookInstance.STATUS_MAINTENANCE),
+            earliest_due_back=models.Min('bookinstance__due_back',
+                                         filter=models.Q(bookinstance__status=BookInstance.STATUS_ON_LOAN)),
+        )
+
+
+class BookInstanceQuerySet(models.QuerySet):
+    def overdue(self, today=None):
+        """
+            Copies on loan past their due date, filtered on the raw columns so the
+            ``status``/``due_back`` index answers it.
+        """
+        return self.filter(status=BookInstance.STATUS_ON_LOAN, due_back__lt=today or timezone.localdate())
+
+    def with_overdue(self, today=None):
+        """
+            Annotate each copy with ``is_overdue`` and ``overdue_by``, how long it
+            has been overdue (None if it is not), computed by the database.
+        """
+        today = today or timezone.localdate()
+        overdue = models.Q(status=BookInstance.STATUS_ON_LOAN, due_back__lt=today)
+        return self.annotate(
+            is_overdue=models.Case(models.When(overdue, then=models.Value(True)), default=models.Value(False),
+                                   output_field=models.BooleanField()),
+            overdue_by=models.Case(
+                models.When(overdue, then=models.ExpressionWrapper(
+                    models.Value(today, output_field=models.DateField()) - models.F('due_back'),
+                    output_field=models.DurationField())),
+                default=None, output_field=models.DurationField()),
+        )
+
+
 class Book(models.Model):
-    title = models.CharField(max_length=200)
+    title = models.CharField(max_length=200, db_index=True)
     author = models.ForeignKey('Author', on_delete=models.SET_NULL, null=True)
     summary = models.TextField(max_length=1000, help_text='Enter a brief description of the book')
-    isbn = models.CharField(max_length=13, help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
+    # Nullable only so that conflicting legacy ISBNs could be cleared when the
+    # unique constraint was introduced; forms still require a value.
+    isbn = models.CharField(max_length=13, unique=True, null=True, help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
     genre = models.ManyToManyField(Genre, help_text='Select a genre for this book')
-    picture = models.ImageField(upload_to='book_images/%Y/%m/%d/', null=True, blank=True, default='book_images/no_profile_picture.png')
-    file = models.FileField(upload_to='book_pdf/%Y/%m/%d/', null=True, blank=True, default='book_pdf/no_pdf.pdf')
+    picture = models.ImageField(upload_to='book_images/%Y/%m/%d/', null=True, blank=True, default='book_images/no_profile_picture.png', storage=content_addressed_storage)
+    file = models.FileField(upload_to='book_pdf/%Y/%m/%d/', null=True, blank=True, default='book_pdf/no_pdf.pdf', storage=content_addressed_storage)
+    # Denormalised from the copies by catalog.stats.refresh_books, so the list
+    # can filter and sort on availability without joining the copies.
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+    next_due_back = models.DateField(null=True, blank=True, editable=False)
+
+    # Moves whenever the book, its genres or authors, or one of its copies
+    # change: the validator of the pages showing it (see catalog.conditional).
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    AVAILABILITY_FIELDS = ('copies_total', 'copies_available', 'next_due_back')
+
+    objects = BookQuerySet.as_manager()
 
     def __str__(self):
         return self.title
@@ -29,6 +90,13 @@ class Book(models.Model):
     def get_absolute_url(self):
         return reverse('book-detail', args=[str(self.id)])
 
+    def save(self, *args, **kwargs):
+        # A full save of a loaded book must not write back availability read before a loan changed it.
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.AVAILABILITY_FIELDS]
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['title']
 
@@ -59,23 +127,43 @@ class BookInstance(models.Model):
         help_text='Book availability',
     )
 
+    objects = BookInstanceQuerySet.as_manager()
+
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"), ("can_create_book", "Create new book"), ("can_update_book", "Update book details"), ("can_delete_book", "Delete book"),)
+        indexes = [
+            models.Index(fields=['status', 'due_back'], name='catalog_bi_status_due_idx'),
+            models.Index(fields=['borrower', 'status', 'due_back'], name='catalog_bi_borrower_idx'),
+            models.Index(fields=['due_back'], name='catalog_bi_due_back_idx'),
+        ]
 
-
+    # Read from the annotations of BookInstanceQuerySet.with_overdue() when the
+    # copy was loaded through it, computed here otherwise.
     @property
     def is_overdue(self):
-        if self.due_back and date.today() > self.due_back:
-            return True
-        return False
+        if hasattr(self, '_is_overdue'):
+            return self._is_overdue
+        return bool(self.status == self.STATUS_ON_LOAN and self.due_back and timezone.localdate() > self.due_back)
+
+    @is_overdue.setter
+    def is_overdue(self, value):
+        self._is_overdue = bool(value)
+
+    @property
+    def days_overdue(self):
+        if hasattr(self, 'overdue_by'):
+            return self.overdue_by.days if self.overdue_by is not None else 0
+        return (timezone.localdate() - self.due_back).days if self.is_overdue else 0
+
 
 class Author(models.Model):
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField(null=True, blank=True)
-    author_profile_picture = models.ImageField(upload_to='author_images/%Y/%m/%d/', null=True, blank=True, default='author_images/no_image.png')
+    author_profile_picture = models.ImageField(upload_to='author_images/%Y/%m/%d/', null=True, blank=True, default='author_images/no_image.png', storage=content_addressed_storage)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def get_absolute_url(self):
         return reverse('author-detail', args=[str(self.id)])
@@ -86,14 +174,152 @@ class Author(models.Model):
     class Meta:
         ordering = ['last_name', 'first_name']
         permissions = (("can_create_author", "Create new author"), ("can_update_author", "Update author details"), ("can_delete_author", "Delete author"),)
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='catalog_author_name_idx'),
+        ]
 
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True)
     profile_picture = models.ImageField(upload_to='customer_profile_images/%Y/%m/%d/', null=True, blank=True,
-                                        verbose_name="Profile Picture", default='author_images/no_image.png')
+                                        verbose_name="Profile Picture", default='author_images/no_image.png',
+                                        storage=content_addressed_storage)
     phone_number = models.CharField(null=True, blank=True, max_length=10)
 
     def __str__(self):
         return f'{self.user.first_name} {self.user.last_name}'
 
+
+
+class CatalogCounter(models.Model):
+    BOOKS = 'books'
+    INSTANCES = 'instances'
+    INSTANCES_AVAILABLE = 'instances_available'
+    AUTHORS = 'authors'
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class OutboundEmail(models.Model):
+    STATUS_PENDING = 'p'
+    STATUS_SENDING = 's'
+    STATUS_SENT = 'd'
+    STATUS_FAILED = 'f'
+
+    DELIVERY_STATUS = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    # One address per line.
+    recipients = models.TextField()
+    # Name of a file in the default storage, read when the message is sent.
+    attachment = models.CharField(max_length=255, blank=True)
+    attachment_mimetype = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=1, choices=DELIVERY_STATUS, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='catalog_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.recipients.split())}'
+
+
+class DownloadLink(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    book = models.ForeignKey('Book', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    downloads = models.PositiveIntegerField(default=0)
+    last_downloaded_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.book} for {self.user}'
+
+
+class OverdueReminder(models.Model):
+    """
+        Marks a borrower as sent the overdue digest of a day, see catalog.reminders.
+    """
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE)
+    sent_on = models.DateField()
+    loans = models.PositiveIntegerField()
+    email = models.ForeignKey('OutboundEmail', on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        ordering = ['-sent_on']
+        unique_together = (('borrower', 'sent_on'),)
+
+    def __str__(self):
+        return f'{self.borrower} on {self.sent_on}'
+
+
+class Reservation(models.Model):
+    """
+        A patron's place in the FIFO queue of a book, see catalog.reservations.
+    """
+    STATUS_WAITING = 'w'
+    STATUS_READY = 'r'
+    STATUS_FULFILLED = 'f'
+    STATUS_EXPIRED = 'e'
+    STATUS_CANCELLED = 'c'
+
+    RESERVATION_STATUS = (
+        (STATUS_WAITING, 'Waiting'),
+        (STATUS_READY, 'Ready for collection'),
+        (STATUS_FULFILLED, 'Fulfilled'),
+        (STATUS_EXPIRED, 'Expired'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    )
+
+    ACTIVE = (STATUS_WAITING, STATUS_READY)
+
+    book = models.ForeignKey('Book', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Increases along each book's queue; the head is the lowest waiting position.
+    position = models.PositiveIntegerField()
+    status = models.CharField(max_length=1, choices=RESERVATION_STATUS, default=STATUS_WAITING)
+    # The copy held for the patron once the reservation is ready.
+    copy = models.ForeignKey('BookInstance', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['book', 'position']
+        unique_together = (('book', 'position'),)
+        indexes = [
+            models.Index(fields=['book', 'status', 'position'], name='catalog_reservation_queue_idx'),
+            models.Index(fields=['status', 'expires_at'], name='catalog_reservation_hold_idx'),
+            models.Index(fields=['user', 'status'], name='catalog_reservation_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.book} for {self.user}'
+
+
+class StoredFile(models.Model):
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField()
+    references = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.references} references)'
@@ -0,0 +1,109 @@
+"""
+    Database-backed outbox for catalog email.
+
+    Views ``enqueue`` a message and return straight away; the
+    ``send_queued_email`` command claims due messages and delivers them in
+    batches, one mail server connection per batch. Failed deliveries are
+    retried with exponential backoff until ``CATALOG_EMAIL_MAX_ATTEMPTS``.
+"""
+import datetime
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from catalog.models import OutboundEmail
+
+# A claimed message that is not settled within this time is claimable again,
+# so messages held by a crashed worker are not lost.
+LEASE = datetime.timedelta(minutes=10)
+
+CLAIMABLE = (OutboundEmail.STATUS_PENDING, OutboundEmail.STATUS_SENDING)
+
+
+def enqueue(subject, body, recipients, attachment='', attachment_mimetype='', from_email=None):
+    """
+        Queue a message; ``attachment`` is the name of a file in the default storage.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.CATALOG_EMAIL_SENDER,
+        recipients='\n'.join(recipients),
+        attachment=attachment,
+        attachment_mimetype=attachment_mimetype,
+    )
+
+
+def claim(limit, among=None):
+    """
+        Claim up to ``limit`` due messages for the calling worker, only those
+        whose id is in ``among`` (a list or a queryset of ids) if it is given.
+    """
+    now = timezone.now()
+    due = OutboundEmail.objects.filter(status__in=CLAIMABLE, next_attempt_at__lte=now)
+    if among is not None:
+        due = due.filter(pk__in=among)
+    claimed = []
+    for pk in list(due.values_list('pk', flat=True)[:limit]):
+        # Another worker may claim the same row first, only one update matches.
+        if due.filter(pk=pk).update(status=OutboundEmail.STATUS_SENDING, next_attempt_at=now + LEASE):
+            claimed.append(pk)
+    return list(OutboundEmail.objects.filter(pk__in=claimed))
+
+
+def build_message(email, connection):
+    message = EmailMessage(email.subject, email.body, email.from_email, email.recipients.split(),
+                           connection=connection)
+    if email.attachment:
+        with default_storage.open(email.attachment) as attachment:
+            message.attach(os.path.basename(email.attachment), attachment.read(),
+                           email.attachment_mimetype or None)
+    return message
+
+
+def record_failure(email, error):
+    attempts = email.attempts + 1
+    retry_delay = datetime.timedelta(seconds=getattr(settings, 'CATALOG_EMAIL_RETRY_DELAY', 60))
+    if attempts >= getattr(settings, 'CATALOG_EMAIL_MAX_ATTEMPTS', 5):
+        status, next_attempt_at = OutboundEmail.STATUS_FAILED, email.next_attempt_at
+    else:
+        status, next_attempt_at = OutboundEmail.STATUS_PENDING, timezone.now() + retry_delay * 2 ** (attempts - 1)
+    OutboundEmail.objects.filter(pk=email.pk).update(status=status, attempts=attempts,
+                                                     next_attempt_at=next_attempt_at, last_error=repr(error))
+
+
+def deliver(emails, connection=None):
+    """
+        Send claimed messages over a single connection and return how many went out.
+        A connection the caller has already opened is left open for its next batch.
+    """
+    connection = connection or get_connection()
+    try:
+        opened = connection.open()
+    except OSError as exc:
+        for email in emails:
+            record_failure(email, exc)
+        return 0
+
+    sent = 0
+    try:
+        for email in emails:
+            try:
+                build_message(email, connection).send()
+            except Exception as exc:
+                # A message that cannot be sent (a bad header or address, a
+                # missing attachment) must not hold up the rest of the batch.
+                record_failure(email, exc)
+            else:
+                OutboundEmail.objects.filter(pk=email.pk).update(
+                    status=OutboundEmail.STATUS_SENT, attempts=email.attempts + 1, sent_at=timezone.now(),
+                    last_error='')
+                sent += 1
+    finally:
+        # SMTP backends return False from open() when already connected.
+        if opened is not False:
+            connection.close()
+    return sent
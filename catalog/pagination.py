@@ -0,0 +1,179 @@
+"""
+    Keyset (cursor) pagination.
+
+    Instead of ``OFFSET n`` and a ``COUNT(*)`` for the page numbers, each page
+    asks for the rows that sort after (or before) the last row it showed. The
+    position is carried in an opaque cursor holding that row's ordering values,
+    so the cost of a page does not depend on how deep it is and rows inserted
+    meanwhile do not shift the following pages.
+
+    The ordering comes from the queryset (or the model's ``Meta.ordering``) with
+    the primary key appended as a tie breaker. It is applied as a plain
+    ``ORDER BY`` so that the indexes on those columns serve it; nulls of a
+    nullable key therefore sort where the database puts them (first in
+    ascending order on SQLite and MySQL, last on Postgres and Oracle) and the
+    seek condition follows the same rule.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class UnsupportedOrdering(ValueError):
+    pass
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': values, 'd': direction}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        values, direction = payload['v'], payload['d']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in (FORWARD, BACKWARD) or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values, direction
+
+
+class CursorPage:
+    is_cursor_page = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.model = queryset.model
+        self.keys = self._ordering_keys(queryset)
+        self.nulls_largest = connections[queryset.db].features.nulls_order_largest
+
+    def _ordering_keys(self, queryset):
+        ordering = list(queryset.query.order_by or self.model._meta.ordering)
+        keys = []
+        for name in ordering:
+            if not isinstance(name, str) or '__' in name or name == '?':
+                raise UnsupportedOrdering('Cursor pagination needs plain field orderings, got %r' % (name,))
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name in ('pk', self.model._meta.pk.name):
+                name = 'pk'
+            keys.append((name, descending))
+        if 'pk' not in [name for name, descending in keys]:
+            keys.append(('pk', False))
+        return keys
+
+    def _field(self, name):
+        return self.model._meta.pk if name == 'pk' else self.model._meta.get_field(name)
+
+    def _order_by(self, keys):
+        return [F(name).desc() if descending else F(name).asc() for name, descending in keys]
+
+    def _after(self, name, descending, value):
+        after = Q(**{name + ('__lt' if descending else '__gt'): value})
+        if not self._field(name).null:
+            return after
+        # Where the database sorts the nulls of this key in this direction.
+        nulls_first = self.nulls_largest == descending
+        if value is None:
+            return Q(**{name + '__isnull': False}) if nulls_first else Q(pk__in=[])
+        return after if nulls_first else after | Q(**{name + '__isnull': True})
+
+    def _equal(self, name, value):
+        if value is None:
+            return Q(**{name + '__isnull': True})
+        return Q(**{name: value})
+
+    def _seek(self, keys, values):
+        condition = Q(pk__in=[])
+        for index, (name, descending) in enumerate(keys):
+            clause = self._after(name, descending, values[index])
+            for (previous_name, previous_descending), previous_value in zip(keys[:index], values):
+                clause &= self._equal(previous_name, previous_value)
+            condition |= clause
+        name, descending = keys[0]
+        nulls_follow = self._field(name).null and self.nulls_largest != descending
+        if values[0] is not None and not nulls_follow:
+            # A plain range on the leading key lets the database walk its index
+            # in order instead of merging the branches above and sorting them.
+            condition &= Q(**{name + ('__lte' if descending else '__gte'): values[0]})
+        return condition
+
+    def _values(self, obj):
+        return [getattr(obj, name) for name, descending in self.keys]
+
+    def _decode_values(self, values):
+        if len(values) != len(self.keys):
+            raise InvalidCursor(values)
+        try:
+            return [None if value is None else self._field(name).to_python(value)
+                    for (name, descending), value in zip(self.keys, values)]
+        except ValidationError:
+            raise InvalidCursor(values)
+
+    def _queryset(self, keys, values=None):
+        queryset = self.queryset.order_by(*self._order_by(keys))
+        if values is not None:
+            queryset = queryset.filter(self._seek(keys, values))
+        return queryset
+
+    def page(self, cursor=None):
+        keys, values, direction = self.keys, None, FORWARD
+        if cursor:
+            values, direction = decode_cursor(cursor)
+            values = self._decode_values(values)
+        if direction == BACKWARD:
+            keys = [(name, not descending) for name, descending in self.keys]
+
+        rows = list(self._queryset(keys, values)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == BACKWARD:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(self._values(rows[-1]), FORWARD)
+        if rows and has_previous:
+            previous_cursor = encode_cursor(self._values(rows[0]), BACKWARD)
+        return CursorPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,138 @@
+"""
+    Per-request performance instrumentation.
+
+    ``PerformanceMiddleware`` profiles a sample of requests (see
+    ``CATALOG_PERFORMANCE_SAMPLE_RATE``) and records wall time, the number and
+    total duration of SQL queries, template render time and repeated SQL
+    statements, the usual sign of an N+1 loop. The figures are returned in a
+    ``Server-Timing`` header and logged as one JSON line on the
+    ``catalog.performance`` logger.
+
+    Template render time is measured by ``InstrumentedDjangoTemplates``, a
+    drop-in replacement for the ``DjangoTemplates`` backend.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('catalog.performance')
+
+_local = threading.local()
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.statements = Counter()
+        self._template_depth = 0
+
+    @property
+    def queries(self):
+        return sum(self.statements.values())
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (time.perf_counter() - started) * 1000
+            self.statements[sql] += 1
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        profile = current_profile()
+        if profile is None:
+            return self.template.render(context, request)
+        # Only the outermost render counts, nested renders are part of it.
+        profile._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            profile._template_depth -= 1
+            if not profile._template_depth:
+                profile.template_ms += (time.perf_counter() - started) * 1000
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= getattr(settings, 'CATALOG_PERFORMANCE_SAMPLE_RATE', 0.0):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        _local.profile = profile
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+        profile.finish()
+
+        threshold = getattr(settings, 'CATALOG_PERFORMANCE_DUPLICATE_THRESHOLD', 3)
+        duplicates = profile.duplicates(threshold)
+        response['Server-Timing'] = self.server_timing(profile, duplicates)
+        self.log(request, response, profile, duplicates)
+        return response
+
+    def server_timing(self, profile, duplicates):
+        metrics = [
+            'total;dur=%.1f' % profile.total_ms,
+            'db;dur=%.1f;desc="%d queries"' % (profile.sql_ms, profile.queries),
+            'tpl;dur=%.1f' % profile.template_ms,
+        ]
+        if duplicates:
+            metrics.append('dup;desc="%d repeated queries"' % sum(count for sql, count in duplicates))
+        return ', '.join(metrics)
+
+    def log(self, request, response, profile, duplicates):
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(profile.total_ms, 2),
+            'db_ms': round(profile.sql_ms, 2),
+            'queries': profile.queries,
+            'template_ms': round(profile.template_ms, 2),
+            'duplicates': [{'sql': sql, 'count': count} for sql, count in duplicates[:5]],
+        }
+        logger.log(logging.WARNING if duplicates else logging.INFO, json.dumps(record, sort_keys=True))
@@ -0,0 +1,78 @@
+"""
+    Daily digest of overdue loans, one email per borrower.
+
+    ``overdue_loans`` finds every overdue copy with one query on the
+    ``status``/``due_back`` index, ordered by borrower so that ``digests`` can
+    group the rows while they stream. ``queue_digests`` records an
+    ``OverdueReminder`` per borrower and day in the transaction that queues the
+    digest in the outbox, so an interrupted or repeated run never reminds a
+    borrower twice on the same day. The ``send_overdue_reminders`` command then
+    delivers the day's digests, and nothing else in the outbox, over one mail
+    server connection.
+"""
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from catalog import outbox
+from catalog.models import BookInstance, OverdueReminder
+
+SUBJECT = 'Overdue library books'
+
+Digest = namedtuple('Digest', 'borrower_id username email loans')
+
+
+def overdue_loans(today=None):
+    today = today or timezone.localdate()
+    return (BookInstance.objects
+            .overdue(today).filter(borrower__isnull=False)
+            .order_by('borrower_id', 'due_back')
+            .values_list('borrower_id', 'borrower__username', 'borrower__email', 'book__title', 'due_back'))
+
+
+def digests(loans, chunk_size=2000):
+    """
+        Group the rows of ``overdue_loans`` into one ``Digest`` per borrower.
+    """
+    for borrower_id, rows in groupby(loans.iterator(chunk_size=chunk_size), key=itemgetter(0)):
+        rows = list(rows)
+        yield Digest(borrower_id, rows[0][1], rows[0][2], [(title, due_back) for *_, title, due_back in rows])
+
+
+def digest_body(digest, today):
+    lines = ['Hello ' + digest.username, '',
+             ' The following books are overdue, please return or renew them:', '']
+    for title, due_back in digest.loans:
+        days = (today - due_back).days
+        lines.append(' %s, due back %s (%d day%s overdue)' % (title, due_back, days, '' if days == 1 else 's'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def queue_digests(batch, today=None, dry_run=False):
+    """
+        Queue the digests of ``batch`` whose borrower was not reminded on ``today``
+        yet and return how many were (or, with ``dry_run``, would be) queued.
+    """
+    today = today or timezone.localdate()
+    batch = [digest for digest in batch if digest.email]
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                reminded = set(OverdueReminder.objects.filter(
+                    sent_on=today, borrower_id__in=[digest.borrower_id for digest in batch],
+                ).values_list('borrower_id', flat=True))
+                pending = [digest for digest in batch if digest.borrower_id not in reminded]
+                if dry_run:
+                    return len(pending)
+                OverdueReminder.objects.bulk_create([
+                    OverdueReminder(borrower_id=digest.borrower_id, sent_on=today, loans=len(digest.loans),
+                                    email=outbox.enqueue(SUBJECT, digest_body(digest, today), [digest.email]))
+                    for digest in pending])
+                return len(pending)
+        except IntegrityError:
+            # A concurrent run reminded some of these borrowers first; look again.
+            if attempt:
+                raise
@@ -0,0 +1,148 @@
+"""
+    Reservation queue for books with no copy on the shelf.
+
+    Each book has a FIFO queue of ``Reservation`` rows in ``position`` order.
+    Every change to a queue first locks the book row, so positions are handed
+    out in turn and two check-ins never serve the same patron.
+
+    When a copy is checked in, ``loans.return_copy`` calls ``assign`` in the
+    same transaction. The head of the queue is one lookup on the
+    (book, status, position) index, whatever the length of the queue. The
+    copy goes from its borrower straight to the hold shelf as reserved for
+    that patron, and another patron can never borrow it in between. A copy
+    saved as available (a new copy, or one back from maintenance) is offered
+    to the queue the same way by ``catalog.signals.serve_reservations``.
+
+    A held copy waits ``CATALOG_RESERVATION_HOLD_DAYS`` to be collected with
+    ``loans.borrow_held``. The ``expire_reservations`` command expires the
+    holds nobody collected and passes their copies on to the next in line.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from catalog import outbox, stats
+from catalog.models import Book, BookInstance, CatalogCounter, Reservation
+
+SUBJECT = 'Your reserved book is ready'
+
+
+class ReservationConflict(Exception):
+    pass
+
+
+def hold_period():
+    return datetime.timedelta(days=getattr(settings, 'CATALOG_RESERVATION_HOLD_DAYS', 3))
+
+
+def lock_book(book_id):
+    """
+        Lock the book row for the rest of the transaction and return its number
+        of available copies, or None if there is no such book.
+    """
+    return (Book.objects.select_for_update().filter(pk=book_id)
+            .values_list('copies_available', flat=True).first())
+
+
+def reserve(book_id, user):
+    """
+        Put ``user`` at the end of the queue of a book with no copy available.
+    """
+    with transaction.atomic():
+        available = lock_book(book_id)
+        if available is None:
+            raise ReservationConflict('This book is no longer in the catalog.')
+        if available:
+            raise ReservationConflict('A copy of this book is available, borrow it instead.')
+        queue = Reservation.objects.filter(book_id=book_id)
+        if queue.filter(user=user, status__in=Reservation.ACTIVE).exists():
+            raise ReservationConflict('You have already reserved this book.')
+        last = queue.aggregate(last=Max('position'))['last'] or 0
+        return Reservation.objects.create(book_id=book_id, user=user, position=last + 1)
+
+
+def next_in_line(book_id):
+    return (Reservation.objects.filter(book_id=book_id, status=Reservation.STATUS_WAITING)
+            .select_related('user', 'book').order_by('position').first())
+
+
+def notify(reservation, expires_at):
+    if not reservation.user.email:
+        return
+    body = ('Hello %s\n\n A copy of "%s" is waiting for you. Please collect it by %s, after which it '
+            'goes to the next patron in line.\n\n') % (reservation.user.username, reservation.book.title,
+                                                       timezone.localtime(expires_at).strftime('%Y-%m-%d %H:%M'))
+    outbox.enqueue(SUBJECT, body, [reservation.user.email])
+
+
+def assign(copy_id, book_id):
+    """
+        Hold the available or reserved copy ``copy_id`` for the head of the
+        book's queue and return that reservation, or None if nobody is waiting.
+        The caller adjusts the availability counters.
+    """
+    lock_book(book_id)
+    reservation = next_in_line(book_id)
+    if reservation is None:
+        return None
+    held = (BookInstance.objects
+            .filter(pk=copy_id, status__in=(BookInstance.STATUS_AVAILABLE, BookInstance.STATUS_RESERVED))
+            .update(status=BookInstance.STATUS_RESERVED, borrower_id=reservation.user_id, due_back=None))
+    if not held:
+        return None
+    expires_at = timezone.now() + hold_period()
+    Reservation.objects.filter(pk=reservation.pk).update(status=Reservation.STATUS_READY, copy_id=copy_id,
+                                                         expires_at=expires_at)
+    notify(reservation, expires_at)
+    return reservation
+
+
+def release(copy_id, book_id):
+    """
+        Pass a copy whose hold ended to the next in line, or back to the shelf.
+    """
+    if copy_id is None:
+        return
+    if assign(copy_id, book_id) is None:
+        shelved = (BookInstance.objects.filter(pk=copy_id, status=BookInstance.STATUS_RESERVED)
+                   .update(status=BookInstance.STATUS_AVAILABLE, borrower=None, due_back=None))
+        stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, shelved)
+    stats.refresh_books([book_id])
+
+
+def cancel(reservation_id, user):
+    with transaction.atomic():
+        row = (Reservation.objects.filter(pk=reservation_id, user=user, status__in=Reservation.ACTIVE)
+               .values_list('book_id', 'copy_id', 'status').first())
+        if row is None:
+            raise ReservationConflict('This reservation is no longer active.')
+        book_id, copy_id, status = row
+        lock_book(book_id)
+        if not Reservation.objects.filter(pk=reservation_id, status=status).update(
+                status=Reservation.STATUS_CANCELLED):
+            raise ReservationConflict('This reservation is no longer active.')
+        if status == Reservation.STATUS_READY:
+            release(copy_id, book_id)
+
+
+def expire_holds(now=None, batch_size=100):
+    """
+        Expire the holds not collected by ``now``, one transaction per batch,
+        and return how many were expired.
+    """
+    due = Reservation.objects.filter(status=Reservation.STATUS_READY, expires_at__lte=now or timezone.now())
+    expired = 0
+    while True:
+        batch = list(due.order_by('expires_at').values_list('pk', 'book_id', 'copy_id')[:batch_size])
+        if not batch:
+            return expired
+        with transaction.atomic():
+            for pk, book_id, copy_id in batch:
+                lock_book(book_id)
+                # A hold collected since the batch was read no longer matches.
+                if due.filter(pk=pk).update(status=Reservation.STATUS_EXPIRED):
+                    expired += 1
+                    release(copy_id, book_id)
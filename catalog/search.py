@@ -0,0 +1,299 @@
+"""
+    Full-text search over the book catalog.
+
+    Every book is indexed as one document made of its title, summary, ISBN,
+    author name and genre names. The index lives next to the catalog tables
+    and is kept current by the receivers in ``catalog.signals``:
+
+    - SQLite uses an FTS5 virtual table ranked with its built-in ``bm25()``.
+    - Postgres uses a weighted ``tsvector`` table with a GIN index ranked with
+      ``ts_rank_cd`` (length normalised, the closest Postgres gets to BM25).
+    - Any other database falls back to ``icontains`` filtering.
+
+    Every query term is matched as a prefix so results show up while the
+    patron is still typing. ``search_books`` returns the best matching ids;
+    ``ranked_queryset`` filters and orders a book queryset by relevance in SQL,
+    so the search page can page through every match.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection, OperationalError
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SQLITE_TABLE = 'catalog_book_fts'
+POSTGRES_TABLE = 'catalog_book_search'
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return [term.lower() for term in TERM_RE.findall(query or '')]
+
+
+def _book_id_column(queryset):
+    quote = connection.ops.quote_name
+    return '%s.%s' % (quote(queryset.model._meta.db_table), quote(queryset.model._meta.pk.column))
+
+
+def _matching(queryset, book_ids_sql, params):
+    # pk__in=RawSQL(...) would render "IN ((SELECT ...))", a single row scalar subquery.
+    return queryset.extra(where=[_book_id_column(queryset) + ' IN (' + book_ids_sql + ')'], params=params)
+
+
+def _id_filter(book_ids):
+    if book_ids is None:
+        return '', []
+    return ' WHERE b.id IN (%s)' % ', '.join(['%s'] * len(book_ids)), list(book_ids)
+
+
+class SearchBackend:
+    def install(self, cursor):
+        pass
+
+    def uninstall(self, cursor):
+        pass
+
+    def is_installed(self):
+        return True
+
+    def index_books(self, book_ids):
+        pass
+
+    def remove_books(self, book_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, terms, limit):
+        raise NotImplementedError
+
+    def rank(self, queryset, terms):
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    # Column weights for bm25(), in table column order.
+    WEIGHTS = (10.0, 1.0, 8.0, 5.0, 2.0)
+
+    DOCUMENT_SQL = (
+        "INSERT INTO " + SQLITE_TABLE + " (rowid, title, summary, isbn, author, genre) "
+        "SELECT b.id, b.title, b.summary, b.isbn, "
+        "COALESCE(a.first_name || ' ' || a.last_name, ''), "
+        "COALESCE((SELECT group_concat(g.name, ' ') FROM catalog_book_genre bg "
+        "JOIN catalog_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '') "
+        "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id"
+    )
+
+    def __init__(self):
+        self._installed = False
+
+    def install(self, cursor):
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS " + SQLITE_TABLE + " USING fts5("
+                "title, summary, isbn, author, genre, "
+                "prefix='2 3', tokenize='unicode61 remove_diacritics 1')"
+            )
+        except OperationalError:
+            # SQLite was built without FTS5, searches fall back to icontains.
+            pass
+
+    def uninstall(self, cursor):
+        cursor.execute("DROP TABLE IF EXISTS " + SQLITE_TABLE)
+        self._installed = False
+
+    def is_installed(self):
+        if not self._installed:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [SQLITE_TABLE])
+                self._installed = cursor.fetchone() is not None
+        return self._installed
+
+    def index_books(self, book_ids):
+        if not book_ids or not self.is_installed():
+            return
+        where, params = _id_filter(book_ids)
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + SQLITE_TABLE + " WHERE rowid IN (%s)" % ', '.join(['%s'] * len(params)), params)
+            cursor.execute(self.DOCUMENT_SQL + where, params)
+
+    def remove_books(self, book_ids):
+        if not book_ids or not self.is_installed():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + SQLITE_TABLE + " WHERE rowid IN (%s)" % ', '.join(['%s'] * len(book_ids)), list(book_ids))
+
+    def rebuild(self):
+        if not self.is_installed():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + SQLITE_TABLE)
+            cursor.execute(self.DOCUMENT_SQL, [])
+
+    def match(self, terms):
+        return ' AND '.join('"%s"*' % term for term in terms)
+
+    def bm25(self):
+        return "bm25(" + SQLITE_TABLE + ", " + ', '.join(str(weight) for weight in self.WEIGHTS) + ")"
+
+    def search(self, terms, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM " + SQLITE_TABLE + " WHERE " + SQLITE_TABLE + " MATCH %s "
+                "ORDER BY " + self.bm25() + " LIMIT %s",
+                [self.match(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def rank(self, queryset, terms):
+        match = self.match(terms)
+        matching = "SELECT rowid FROM " + SQLITE_TABLE + " WHERE " + SQLITE_TABLE + " MATCH %s"
+        # bm25() is lower for better matches; the rowid lookup scores one document.
+        score = RawSQL("SELECT " + self.bm25() + " FROM " + SQLITE_TABLE + " WHERE " + SQLITE_TABLE + " MATCH %s "
+                       "AND rowid = " + _book_id_column(queryset), [match], output_field=FloatField())
+        return _matching(queryset, matching, [match]).order_by(score.asc(), 'pk')
+
+
+class PostgresBackend(SearchBackend):
+    DOCUMENT_SQL = (
+        "INSERT INTO " + POSTGRES_TABLE + " (book_id, document) "
+        "SELECT b.id, "
+        "setweight(to_tsvector('simple', coalesce(b.title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(b.isbn, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(a.first_name || ' ' || a.last_name, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce((SELECT string_agg(g.name, ' ') FROM catalog_book_genre bg "
+        "JOIN catalog_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '')), 'C') || "
+        "setweight(to_tsvector('simple', coalesce(b.summary, '')), 'D') "
+        "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id"
+    )
+    UPSERT_SQL = " ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document"
+
+    def install(self, cursor):
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS " + POSTGRES_TABLE + " ("
+            "book_id integer PRIMARY KEY, document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS " + POSTGRES_TABLE + "_document_gin "
+            "ON " + POSTGRES_TABLE + " USING gin (document)"
+        )
+
+    def uninstall(self, cursor):
+        cursor.execute("DROP TABLE IF EXISTS " + POSTGRES_TABLE)
+
+    def index_books(self, book_ids):
+        if not book_ids:
+            return
+        where, params = _id_filter(book_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(self.DOCUMENT_SQL + where + self.UPSERT_SQL, params)
+
+    def remove_books(self, book_ids):
+        if not book_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + POSTGRES_TABLE + " WHERE book_id = ANY(%s)", [list(book_ids)])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE " + POSTGRES_TABLE)
+            cursor.execute(self.DOCUMENT_SQL, [])
+
+    def tsquery(self, terms):
+        return ' & '.join("'%s':*" % term for term in terms)
+
+    def search(self, terms, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT book_id FROM " + POSTGRES_TABLE + ", to_tsquery('simple', %s) query "
+                "WHERE document @@ query ORDER BY ts_rank_cd(document, query, 1) DESC, book_id LIMIT %s",
+                [self.tsquery(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def rank(self, queryset, terms):
+        tsquery = self.tsquery(terms)
+        matching = "SELECT book_id FROM " + POSTGRES_TABLE + " WHERE document @@ to_tsquery('simple', %s)"
+        score = RawSQL("SELECT ts_rank_cd(document, to_tsquery('simple', %s), 1) FROM " + POSTGRES_TABLE + " "
+                       "WHERE book_id = " + _book_id_column(queryset), [tsquery], output_field=FloatField())
+        return _matching(queryset, matching, [tsquery]).order_by(score.desc(), 'pk')
+
+
+class FallbackBackend(SearchBackend):
+    def matching(self, terms):
+        from catalog.models import Book
+
+        queryset = Book.objects.all()
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term) | Q(summary__icontains=term) | Q(isbn__icontains=term) |
+                Q(author__first_name__icontains=term) | Q(author__last_name__icontains=term) |
+                Q(genre__name__icontains=term)
+            )
+        return queryset.values_list('pk', flat=True).distinct()
+
+    def search(self, terms, limit):
+        return list(self.matching(terms)[:limit])
+
+    def rank(self, queryset, terms):
+        # No relevance here, the queryset keeps its own order.
+        return queryset.filter(pk__in=self.matching(terms))
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresBackend,
+}
+
+_backends = {}
+
+
+def get_backend(vendor=None):
+    vendor = vendor or connection.vendor
+    if vendor not in _backends:
+        _backends[vendor] = BACKENDS.get(vendor, FallbackBackend)()
+    return _backends[vendor]
+
+
+def index_books(book_ids):
+    get_backend().index_books(list(book_ids))
+
+
+def remove_books(book_ids):
+    get_backend().remove_books(list(book_ids))
+
+
+def rebuild_index():
+    get_backend().rebuild()
+
+
+def searching_backend():
+    backend = get_backend()
+    if not backend.is_installed():
+        return FallbackBackend()
+    return backend
+
+
+def search_books(query, limit=None):
+    """
+        Return the ids of the best ``limit`` books matching every term of
+        ``query``, best match first.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    limit = limit or getattr(settings, 'CATALOG_SEARCH_RESULT_LIMIT', 200)
+    return searching_backend().search(terms, limit)
+
+
+def ranked_queryset(queryset, query):
+    """
+        Restrict ``queryset`` to every book matching ``query``, ordered by relevance.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset.none()
+    return searching_backend().rank(queryset, terms)
@@ -0,0 +1,221 @@
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from catalog import conditional, fragments, images, reservations, search, stats, storage
+from catalog.models import Author, Book, BookInstance, CatalogCounter, Genre, Profile
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.remove_books([instance.pk])
+
+
+def changed_genre_books(instance, reverse, pk_set):
+    if not reverse:
+        return [instance.pk]
+    if pk_set:
+        return pk_set
+    return getattr(instance, '_search_book_ids', [])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def index_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        search.index_books(changed_genre_books(instance, reverse, pk_set))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def remember_cleared_genre_books(sender, instance, action, reverse, **kwargs):
+    # genre.book_set.clear() reports no pk_set, so collect the books beforehand.
+    if action == 'pre_clear' and reverse:
+        instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def index_related_books(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def remember_related_books(sender, instance, **kwargs):
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def reindex_related_books(sender, instance, **kwargs):
+    search.index_books(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.adjust(CatalogCounter.BOOKS if sender is Book else CatalogCounter.AUTHORS, 1)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+def count_deleted(sender, instance, **kwargs):
+    stats.adjust(CatalogCounter.BOOKS if sender is Book else CatalogCounter.AUTHORS, -1)
+
+
+@receiver(post_init, sender=BookInstance)
+def remember_counted_status(sender, instance, **kwargs):
+    # Read __dict__ directly so a deferred status is not fetched.
+    instance._counted_status = instance.__dict__.get('status')
+    instance._counted_book_id = instance.__dict__.get('book_id')
+
+
+@receiver(pre_save, sender=BookInstance)
+def fetch_counted_status(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A copy loaded without its status or book reads the stored values before
+    # they are overwritten, in one query instead of a recount afterwards.
+    if raw or instance._state.adding or (instance._counted_status is not None and
+                                         instance._counted_book_id is not None):
+        return
+    if update_fields is not None and not {'status', 'book'} & set(update_fields):
+        return
+    stored = BookInstance.objects.filter(pk=instance.pk).values_list('status', 'book_id').first()
+    if stored is not None:
+        instance._counted_status, instance._counted_book_id = stored
+
+
+@receiver(post_save, sender=BookInstance)
+def count_saved_instance(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    available = instance.status == BookInstance.STATUS_AVAILABLE
+    if created:
+        stats.adjust(CatalogCounter.INSTANCES, 1)
+        stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, int(available))
+    elif update_fields is None or 'status' in update_fields:
+        was_available = instance._counted_status == BookInstance.STATUS_AVAILABLE
+        stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, int(available) - int(was_available))
+    instance._counted_status = instance.status
+
+
+@receiver(post_save, sender=BookInstance)
+def refresh_book_availability(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not {'status', 'due_back', 'book'} & set(update_fields)):
+        return
+    stats.refresh_books([instance.book_id, instance._counted_book_id])
+    instance._counted_book_id = instance.book_id
+
+
+@receiver(post_save, sender=BookInstance)
+def serve_reservations(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # A copy put on the shelf by a save (a new copy, or one back from
+    # maintenance) goes to the head of its book's queue like a returned one.
+    if raw or instance.status != BookInstance.STATUS_AVAILABLE or instance.book_id is None:
+        return
+    if not created and update_fields is not None and 'status' not in update_fields:
+        return
+    reservation = reservations.assign(instance.pk, instance.book_id)
+    if reservation is None:
+        return
+    instance.status, instance.borrower_id, instance.due_back = BookInstance.STATUS_RESERVED, reservation.user_id, None
+    instance._counted_status = instance.status
+    stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, -1)
+    stats.refresh_books([instance.book_id])
+
+
+@receiver(post_delete, sender=BookInstance)
+def refresh_deleted_instance_book(sender, instance, **kwargs):
+    stats.refresh_books([instance.book_id])
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_deleted_instance(sender, instance, **kwargs):
+    stats.adjust(CatalogCounter.INSTANCES, -1)
+    stats.adjust(CatalogCounter.INSTANCES_AVAILABLE, -int(instance._counted_status == BookInstance.STATUS_AVAILABLE))
+
+
+@receiver(pre_save, sender=Book)
+@receiver(pre_save, sender=Author)
+@receiver(pre_save, sender=Profile)
+def remember_uploaded_images(sender, instance, raw=False, **kwargs):
+    # Files assigned since the last save are committed to storage by this save.
+    fields = () if raw else images.IMAGE_FIELDS[sender]
+    instance._uploaded_images = [name for name in fields
+                                 if getattr(instance, name) and not getattr(instance, name)._committed]
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Profile)
+def make_upload_renditions(sender, instance, **kwargs):
+    for name in getattr(instance, '_uploaded_images', ()):
+        for rendition in images.RENDITIONS:
+            try:
+                images.renditions(getattr(instance, name), rendition)
+            except (OSError, ValueError):
+                # Not an image Pillow can read; templates fall back to the original.
+                break
+
+
+@receiver(post_init, sender=Book)
+@receiver(post_init, sender=Author)
+@receiver(post_init, sender=Profile)
+def remember_stored_files(sender, instance, **kwargs):
+    instance._stored_files = storage.referenced_names(instance)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Profile)
+def count_file_references(sender, instance, **kwargs):
+    current = storage.referenced_names(instance)
+    storage.adjust_references(current, instance._stored_files)
+    instance._stored_files = current
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Profile)
+def release_file_references(sender, instance, **kwargs):
+    storage.adjust_references([], instance._stored_files)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def expire_fragments(sender, **kwargs):
+    fragments.bump(sender)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def expire_genre_fragments(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        fragments.bump(Book)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def touch_genre_books(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        conditional.touch_books(changed_genre_books(instance, reverse, pk_set))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def touch_related_books(sender, instance, raw=False, **kwargs):
+    if not raw:
+        conditional.touch_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def touch_orphaned_books(sender, instance, **kwargs):
+    conditional.touch_books(getattr(instance, '_search_book_ids', []))
@@ -0,0 +1,108 @@
+"""
+    Catalog statistics shown on the index page, and the availability columns of each book.
+
+    The counts live in ``CatalogCounter`` rows that are adjusted by the
+    receivers in ``catalog.signals`` and by ``update_status`` for bulk
+    status changes, so reading them never runs an aggregate query.
+    ``reconcile`` recounts everything and is run periodically by the
+    ``reconcile_catalog_stats`` command to repair any drift.
+
+    ``Book.copies_total``, ``copies_available`` and ``next_due_back`` are
+    recomputed by ``refresh_books`` in the transaction that changes a copy:
+    from the signals for saved and deleted copies, and explicitly by the loan
+    engine and ``update_status``, whose ``update()`` calls bypass signals.
+    The ``check_book_availability`` command repairs any drift. The refresh
+    also moves ``Book.updated_at``, as the book pages show availability.
+"""
+from django.db import transaction
+from django.db.models import Count, DateField, F, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from catalog.models import Author, Book, BookInstance, CatalogCounter
+
+COUNTERS = (
+    CatalogCounter.BOOKS,
+    CatalogCounter.INSTANCES,
+    CatalogCounter.INSTANCES_AVAILABLE,
+    CatalogCounter.AUTHORS,
+)
+
+
+def count_all():
+    return {
+        CatalogCounter.BOOKS: Book.objects.count(),
+        CatalogCounter.INSTANCES: BookInstance.objects.count(),
+        CatalogCounter.INSTANCES_AVAILABLE: BookInstance.objects.filter(status=BookInstance.STATUS_AVAILABLE).count(),
+        CatalogCounter.AUTHORS: Author.objects.count(),
+    }
+
+
+def get_counts():
+    counts = dict(CatalogCounter.objects.filter(name__in=COUNTERS).values_list('name', 'value'))
+    if len(counts) < len(COUNTERS):
+        counts = reconcile()
+    return counts
+
+
+def adjust(name, delta):
+    if delta:
+        CatalogCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def reconcile():
+    """
+        Recount every statistic from the catalog tables and return the counts.
+    """
+    with transaction.atomic():
+        counts = count_all()
+        now = timezone.now()
+        for name, value in counts.items():
+            CatalogCounter.objects.update_or_create(name=name, defaults={'value': value, 'reconciled_at': now})
+    return counts
+
+
+def update_status(queryset, status):
+    """
+        Bulk ``queryset.update(status=status)`` that keeps the availability counter
+        and the availability columns of the affected books in step.
+    """
+    with transaction.atomic():
+        book_ids = set(queryset.values_list('book_id', flat=True))
+        available_before = queryset.filter(status=BookInstance.STATUS_AVAILABLE).count()
+        updated = queryset.update(status=status)
+        available_after = updated if status == BookInstance.STATUS_AVAILABLE else 0
+        adjust(CatalogCounter.INSTANCES_AVAILABLE, available_after - available_before)
+        refresh_books(book_ids)
+    return updated
+
+
+def availability_columns():
+    """
+        Expressions computing each ``Book`` availability column from its copies.
+    """
+    copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+    def count(queryset):
+        counted = queryset.annotate(copies=Count('pk')).values('copies')
+        return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+    return {
+        'copies_total': count(copies),
+        'copies_available': count(copies.filter(status=BookInstance.STATUS_AVAILABLE)),
+        'next_due_back': Subquery(copies.filter(status=BookInstance.STATUS_ON_LOAN)
+                                  .annotate(due=Min('due_back')).values('due'), output_field=DateField()),
+    }
+
+
+def refresh_books(book_ids):
+    """
+        Recompute the availability columns of the given books.
+    """
+    book_ids = sorted({pk for pk in book_ids if pk is not None})
+    if not book_ids:
+        return
+    with transaction.atomic():
+        # Lock the books in a fixed order so concurrent loans of one book recompute in turn.
+        list(Book.objects.select_for_update().filter(pk__in=book_ids).order_by('pk').values_list('pk', flat=True))
+        Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now(), **availability_columns())
@@ -0,0 +1,164 @@
+"""
+    Content-addressed media storage.
+
+    Uploads to the catalog's file fields are stored under the SHA-256 of
+    their content, ``cas/ab/cd/<sha256>.<ext>``, so identical uploads share
+    one file and a stored name never changes meaning, which lets it be cached
+    forever. Files saved before this storage keep their old names and are
+    served as before.
+
+    Because a file may be shared, deleting it through a field does nothing.
+    ``StoredFile`` rows count the model rows referencing each file, kept up to
+    date by signals, and ``collect_garbage`` removes files nobody references.
+    A row's ``created_at`` is the last time its content was uploaded.
+"""
+import hashlib
+import os
+import posixpath
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+PREFIX = 'cas'
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(PREFIX + '/')
+
+
+def content_digest(name):
+    """
+        The SHA-256 a content-addressed name was derived from.
+    """
+    return posixpath.splitext(posixpath.basename(name))[0]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        if is_content_addressed(name):
+            # Only asked by FileSystemStorage._save() once the file turned out
+            # to exist: there is no other name for this content.
+            raise FileExistsError(name)
+        # The final name is only known once the content is hashed in _save().
+        return name
+
+    def _save(self, name, content):
+        from catalog.models import StoredFile
+
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        digest = sha.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(PREFIX, digest[:2], digest[2:4], digest + extension)
+
+        # The row is stamped before the file is written: an upload of content
+        # nobody references restarts its grace period, and waits for a
+        # collection of the same file that is already under way.
+        if not StoredFile.objects.filter(name=name).update(created_at=timezone.now()):
+            StoredFile.objects.get_or_create(name=name, defaults={'size': content.size})
+        content.seek(0)
+        try:
+            name = super()._save(name, content)
+        except OSError:
+            # An identical upload created the file first, the content is the same.
+            if not self.exists(name):
+                raise
+        return name
+
+    def delete(self, name):
+        if not is_content_addressed(name):
+            super().delete(name)
+
+    def purge(self, name):
+        super().delete(name)
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def file_fields():
+    from catalog.models import Author, Book, Profile
+
+    return {
+        Book: ('picture', 'file'),
+        Author: ('author_profile_picture',),
+        Profile: ('profile_picture',),
+    }
+
+
+def referenced_names(instance):
+    """
+        Content-addressed files an instance points at, without loading deferred fields.
+    """
+    names = []
+    for field in file_fields()[type(instance)]:
+        value = instance.__dict__.get(field)
+        name = getattr(value, 'name', value)
+        if is_content_addressed(name):
+            names.append(name)
+    return names
+
+
+def adjust_references(current, previous):
+    from catalog.models import StoredFile
+
+    delta = Counter(current)
+    delta.subtract(previous)
+    for name, change in delta.items():
+        if change:
+            StoredFile.objects.filter(name=name).update(references=F('references') + change)
+
+
+def reconcile():
+    """
+        Recount the references of every stored file from the model rows and
+        register files found on disk without a row. Returns the counts.
+    """
+    from catalog.models import StoredFile
+
+    counts = Counter()
+    for model, fields in file_fields().items():
+        for names in model.objects.order_by().values_list(*fields).iterator():
+            counts.update(name for name in names if is_content_addressed(name))
+
+    known = set(StoredFile.objects.values_list('name', flat=True))
+    root = content_addressed_storage.path(PREFIX)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            name = posixpath.join(PREFIX, *os.path.relpath(os.path.join(directory, filename), root).split(os.sep))
+            if name not in known:
+                StoredFile.objects.create(name=name, size=content_addressed_storage.size(name))
+                known.add(name)
+
+    for name in known:
+        StoredFile.objects.filter(name=name).exclude(references=counts[name]).update(references=counts[name])
+    return counts
+
+
+def collect_garbage(grace, dry_run=False):
+    """
+        Delete stored files that are referenced by no row and were last
+        uploaded more than ``grace`` ago, which protects uploads whose row is
+        not saved yet.
+    """
+    from catalog.models import StoredFile
+
+    garbage = StoredFile.objects.filter(references__lte=0, created_at__lt=timezone.now() - grace)
+    candidates = list(garbage.values_list('name', 'size'))
+    if dry_run:
+        return candidates
+    collected = []
+    for name, size in candidates:
+        # The row goes first, only if it still qualifies, and the file only with it.
+        with transaction.atomic():
+            deleted, _ = garbage.filter(name=name).delete()
+            if deleted:
+                content_addressed_storage.purge(name)
+                collected.append((name, size))
+    return collected
@@ -0,0 +1,43 @@
+from django import template
+from django.template.base import token_kwargs
+
+from catalog import fragments
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on, depends):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+        self.depends = depends
+
+    def render(self, context):
+        user = context.get('user')
+        return fragments.get_or_render(
+            self.name.resolve(context),
+            self.depends.resolve(context).split(),
+            lambda: self.nodelist.render(context),
+            vary_on=[value.resolve(context) for value in self.vary_on],
+            staff=bool(user and user.is_staff),
+        )
+
+
+@register.tag
+def fragmentcache(parser, token):
+    """
+        Cache the enclosed template until one of the catalog models it depends
+        on changes, separately for staff and patrons, e.g.
+        ``{% fragmentcache 'book-card' book.pk depends='Book Author' %}...{% endfragmentcache %}``.
+        Keep forms (their CSRF token) and loan availability outside the block.
+    """
+    nodelist = parser.parse(('endfragmentcache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3 or not bits[-1].startswith('depends='):
+        raise template.TemplateSyntaxError(
+            "'%s' takes a fragment name, the values it varies on and depends='Model ...'" % bits[0])
+    depends = token_kwargs(bits[-1:], parser)['depends']
+    return FragmentCacheNode(nodelist, parser.compile_filter(bits[1]),
+                             [parser.compile_filter(bit) for bit in bits[2:-1]], depends)
@@ -0,0 +1,37 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from catalog import images
+
+register = template.Library()
+
+MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+@register.simple_tag
+def responsive_image(image, rendition, **attrs):
+    """
+        Render ``image`` as a ``<picture>`` of its resized renditions, e.g.
+        ``{% responsive_image book.picture 'card' alt=book.title class='card-img-top' %}``.
+        Falls back to the original file if it cannot be resized.
+    """
+    if not image:
+        return ''
+    extra = format_html_join('', ' {}="{}"', sorted(attrs.items()))
+    try:
+        description = images.renditions(image, rendition)
+    except (OSError, ValueError):
+        return format_html('<img src="{}"{}>', image.url, extra)
+
+    sources = description['sources']
+    fallback = sources['jpeg']
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" width="{}" height="{}" loading="lazy"{}></picture>',
+        format_html_join('', '<source type="{}" srcset="{}">',
+                         ((MIME_TYPES[fmt], srcset(urls)) for fmt, urls in sources.items() if fmt != 'jpeg')),
+        fallback[0][0], srcset(fallback), description['width'], description['height'], extra,
+    )
+
+
+def srcset(urls):
+    return ', '.join('%s %dx' % (url, density) for url, density in urls)
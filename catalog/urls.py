@@ -11,10 +11,19 @@ urlpatterns = [
     path('customer_signup/', views.CustomerSignUpView.as_view(), name='customer_signup'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
     path('email_book/', views.send_email, name='email_book'),
+    path('download/<str:token>/', views.download_link, name='download_link'),
+    path('book/<int:pk>/download/', views.book_download, name='book_download'),
     path('book/<uuid:pk>/return', views.return_book, name='return_book'),
     path('book/<uuid:pk>/borrow/', views.borrow_book, name='borrow_book'),
+    path('book/<int:pk>/borrow/', views.borrow_any_copy, name='borrow_any_copy'),
+    path('book/<int:pk>/reserve/', views.reserve_book, name='reserve_book'),
+    path('reservations/', views.ReservationListView.as_view(), name='reservations'),
+    path('reservations/<int:pk>/collect/', views.collect_reservation, name='collect_reservation'),
+    path('reservations/<int:pk>/cancel/', views.cancel_reservation, name='cancel_reservation'),
     path('dashboard_customer/', views.LoanedBooksByUserListView.as_view(), name='dashboard_customer'),
     path('dashboard_staff/', views.LoanedBooksAllListView.as_view(), name='dashboard_staff'),
+    path('export/<slug:kind>.<slug:fmt>', views.export_catalog, name='export_catalog'),
+    path('copies/bulk/<slug:action>/', views.bulk_copies, name='bulk_copies'),
     path('search_book/', views.BookSearchListView.as_view(), name='search_book'),
     path('search_author/', views.AuthorSearchListView.as_view(), name='search_author'),
 ]
@@ -1,21 +1,23 @@
 import operator
-import smtplib
 from functools import reduce
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.shortcuts import render
 from django.contrib.auth.mixins import PermissionRequiredMixin
-from catalog.models import Author, Book, BookInstance, Profile
+from catalog import bulk, conditional, delivery, exporter, loans, outbox, reservations, search, stats
+from catalog.models import Author, Book, BookInstance, CatalogCounter, Profile, Reservation
+from catalog.pagination import CursorPaginator, InvalidCursor, UnsupportedOrdering
 from django.views import generic
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.views.generic import View
-from django.core.mail.message import EmailMessage
 from django.utils.decorators import method_decorator
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import Http404, HttpResponseGone, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 import datetime
 from django.contrib.auth.decorators import permission_required
@@ -33,10 +35,11 @@ STATUS_RESERVED = 'r'
 
 
 def index(request):
-        num_books = Book.objects.all().count()
-        num_instances = BookInstance.objects.all().count()
-        num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-        num_authors = Author.objects.count()
+        counts = stats.get_counts()
+        num_books = counts[CatalogCounter.BOOKS]
+        num_instances = counts[CatalogCounter.INSTANCES]
+        num_instances_available = counts[CatalogCounter.INSTANCES_AVAILABLE]
+        num_authors = counts[CatalogCounter.AUTHORS]
         # Number of visits to this view, as counted in the session variable.
         num_visits = request.session.get('num_visits', 0)
         request.session['num_visits'] = num_visits + 1
@@ -51,28 +54,105 @@ def index(request):
         return render(request, 'catalog/index.html', context=context)
 
 
+class QuerysetShapeMixin:
+    """
+        Declare the related rows and columns a view's template needs so they are
+        loaded with a fixed number of queries instead of one query per row.
+    """
+    select_related = ()
+    prefetch_related = ()
+    only = ()
+
+    def shape_queryset(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+    def get_queryset(self):
+        return self.shape_queryset(super().get_queryset())
+
+
+class CursorPaginationMixin:
+    """
+        Opt-in keyset pagination for list views: pages are addressed by the
+        ``cursor`` query parameter instead of ``page`` and no total is counted.
+    """
+    cursor_pagination = False
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.cursor_pagination:
+            return super().paginate_queryset(queryset, page_size)
+        try:
+            paginator = CursorPaginator(queryset, page_size)
+        except UnsupportedOrdering:
+            # Orderings across relations or on expressions cannot be seeked; page them by offset.
+            return super().paginate_queryset(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
 @method_decorator(login_required, 'dispatch')
-class BookListView(generic.ListView):
+@method_decorator(conditional.conditional_page(conditional.book_list), 'dispatch')
+class BookListView(CursorPaginationMixin, QuerysetShapeMixin, generic.ListView):
     model = Book
     paginate_by = 3
+    cursor_pagination = True
+    select_related = ('author',)
+    only = ('title', 'picture', 'copies_available', 'next_due_back', 'author__first_name', 'author__last_name')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.GET.get('available'):
+            queryset = queryset.filter(copies_available__gt=0)
+        return queryset
 
 
 @method_decorator(login_required, 'dispatch')
-class BookDetailView(generic.DetailView):
+@method_decorator(conditional.conditional_page(conditional.book_detail), 'dispatch')
+class BookDetailView(QuerysetShapeMixin, generic.DetailView):
     model = Book
+    select_related = ('author',)
+
+    def get_queryset(self):
+        queryset = super().get_queryset().with_availability()
+        # Staff see every copy, patrons only the availability counts.
+        if self.request.user.is_staff:
+            return queryset.prefetch_related('bookinstance_set')
+        return queryset
 
 
 # @method_decorator(login_required, 'dispatch')
-class AuthorListView(LoginRequiredMixin, generic.ListView):
+@method_decorator(conditional.conditional_page(conditional.author_list), 'dispatch')
+class AuthorListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
     model = Author
     paginate_by = 3
+    cursor_pagination = True
     template_name = 'catalog/author_list.html'
 
 
 @method_decorator(login_required, 'dispatch')
+@method_decorator(conditional.conditional_page(conditional.author_detail), 'dispatch')
 class AuthorDetailView(generic.DetailView):
     model = Author
 
+    def get_object(self, queryset=None):
+        author = getattr(self.request, 'catalog_object', None)
+        if author is None:
+            return super().get_object(queryset)
+        return author
+
+    def get_context_data(self, **kwargs):
+        # Left unevaluated: the template only runs it to rebuild its cached fragment.
+        kwargs['books'] = self.object.book_set.only('title', 'summary', 'author')
+        return super().get_context_data(**kwargs)
+
 
 class CustomerLoginView(View):
     def post(self, request):
@@ -132,43 +212,68 @@ class LogoutView(View):
         return HttpResponseRedirect(reverse('index'))
 
 
+@login_required
 def send_email(request):
-    if request.user.is_authenticated:
-        send_to = request.user.email
-        username = request.user.username
+    book = get_object_or_404(Book.objects.select_related('author'), pk=int(request.POST.get('book_id')))
+
+    # Delivery happens in the send_queued_email worker, outside the request.
+    if settings.CATALOG_EMAIL_DELIVERY == 'link':
+        token = delivery.create_link(book, request.user)
+        download_url = request.build_absolute_uri(reverse('download_link', args=[token]))
+        email_body = "Hello "+request.user.username+"\n\n Please download your requested PDF file from the link below \n\n Book: "+str(book.title)+"\n Book Author: "+str(book.author)+"\n\n "+download_url+"\n\n"
+        outbox.enqueue('Library Book request', email_body, [request.user.email])
+    else:
+        email_body = "Hello "+request.user.username+"\n\n Please find attachment your requested PDF file below \n\n Book: "+str(book.title)+"\n Book Author: "+str(book.author)+"\n\n"
+        outbox.enqueue('Library Book request', email_body, [request.user.email],
+                       attachment=book.file.name if book.file else '', attachment_mimetype='application/pdf')
 
-    book = Book.objects.get(pk=int(request.POST.get('book_id')))
-    book_title = str(book.title)
-    book_author = str(book.author)
-    book_pdf = book.file.path
+    return HttpResponseRedirect(reverse('dashboard_customer', args=[]))
 
-    email_body = "Hello "+username+"\n\n Please find attachment your requested PDF file below \n\n Book: "+book_title+"\n Book Author: "+book_author+"\n\n"
 
+def download_link(request, token):
     try:
-        # send_mail('Book request', email_body, settings.EMAIL_HOST_USER, ['madhok.simran8@gmail.com'], fail_silently=False)
-        email = EmailMessage(
-            'Library Book request',
-            email_body,
-            'sender smtp gmail' + '<dolphin2016water@gmail.com>',
-            [send_to],
-        )
-        email.attach_file(book_pdf, mimetype='application/pdf')
-        email.send()
-    except smtplib.SMTPException:
-        return HttpResponseRedirect(reverse('index'))
+        link = delivery.resolve(token)
+    except delivery.ExpiredLink:
+        return HttpResponseGone('This download link has expired, please request the book again.')
+    except delivery.InvalidLink:
+        raise Http404('Invalid download link')
+    response = serve_book_file(request, link.book, as_attachment=True)
+    if delivery.is_download(request, response):
+        delivery.count_download(link)
+    return response
 
-    return HttpResponseRedirect(reverse('dashboard_customer', args=[]))
 
+@login_required
+def book_download(request, pk):
+    return serve_book_file(request, get_object_or_404(Book, pk=pk))
 
+
+def serve_book_file(request, book, as_attachment=False):
+    if not book.file:
+        raise Http404('This book has no PDF')
+    try:
+        return delivery.serve_book_file(request, book, as_attachment=as_attachment)
+    except FileNotFoundError:
+        raise Http404('The PDF of this book is missing')
+
+
+def loan_conflict(request, book_id, message):
+    context = {
+        'book': Book.objects.with_availability().select_related('author').get(pk=book_id),
+        'loan_error': message,
+    }
+    return render(request, 'catalog/book_detail.html', context, status=409)
+
+
+@login_required
 def borrow_book(request, pk):
     book_instance = get_object_or_404(BookInstance, pk=pk)
     if request.method == 'POST':
-            if request.user.is_authenticated:
-                book_instance.borrower = request.user
-                book_instance.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
-                book_instance.status = STATUS_ON_LOAN
-                book_instance.save()
-                return HttpResponseRedirect(reverse('dashboard_customer'))
+        try:
+            loans.borrow(book_instance.pk, request.user)
+        except loans.LoanConflict:
+            return loan_conflict(request, book_instance.book_id, 'Sorry, this copy has just been borrowed by someone else.')
+        return HttpResponseRedirect(reverse('dashboard_customer'))
 
     context = {
         'book_instance': book_instance,
@@ -177,23 +282,95 @@ def borrow_book(request, pk):
     return render(request, 'catalog/book_detail.html', context)
 
 
+@login_required
+def borrow_any_copy(request, pk):
+    book = get_object_or_404(Book, pk=pk)
+    if request.method != 'POST':
+        return HttpResponseRedirect(book.get_absolute_url())
+    try:
+        loans.borrow_any(book.pk, request.user)
+    except loans.LoanConflict:
+        return loan_conflict(request, book.pk, 'Sorry, all copies of this book are on loan.')
+    return HttpResponseRedirect(reverse('dashboard_customer'))
+
+
+@login_required
+def reserve_book(request, pk):
+    book = get_object_or_404(Book, pk=pk)
+    if request.method != 'POST':
+        return HttpResponseRedirect(book.get_absolute_url())
+    try:
+        reservations.reserve(book.pk, request.user)
+    except reservations.ReservationConflict as exc:
+        return loan_conflict(request, book.pk, str(exc))
+    return HttpResponseRedirect(reverse('reservations'))
+
+
+@login_required
+def collect_reservation(request, pk):
+    reservation = get_object_or_404(Reservation, pk=pk, user=request.user)
+    if request.method != 'POST':
+        return HttpResponseRedirect(reverse('reservations'))
+    try:
+        loans.borrow_held(reservation.pk, request.user)
+    except loans.LoanConflict:
+        return loan_conflict(request, reservation.book_id, 'Sorry, this reservation is no longer held for you.')
+    return HttpResponseRedirect(reverse('dashboard_customer'))
+
+
+@login_required
+def cancel_reservation(request, pk):
+    reservation = get_object_or_404(Reservation, pk=pk, user=request.user)
+    if request.method == 'POST':
+        try:
+            reservations.cancel(reservation.pk, request.user)
+        except reservations.ReservationConflict as exc:
+            return loan_conflict(request, reservation.book_id, str(exc))
+    return HttpResponseRedirect(reverse('reservations'))
+
+
+class ReservationListView(LoginRequiredMixin, QuerysetShapeMixin, generic.ListView):
+    model = Reservation
+    template_name = 'catalog/reservation_list.html'
+    select_related = ('book',)
+
+    def get_queryset(self):
+        ahead = (Reservation.objects.filter(book=OuterRef('book'), status=Reservation.STATUS_WAITING,
+                                            position__lt=OuterRef('position'))
+                 .order_by().values('book').annotate(ahead=Count('pk')).values('ahead'))
+        return (super().get_queryset().filter(user=self.request.user, status__in=Reservation.ACTIVE)
+                .annotate(ahead=Coalesce(Subquery(ahead, output_field=IntegerField()), 0))
+                .order_by('created_at'))
+
+
 # @method_decorator(login_required, 'dispatch')
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksByUserListView(LoginRequiredMixin, QuerysetShapeMixin, generic.ListView):
     model = BookInstance
     template_name = 'catalog/dashboard_customer.html'
+    select_related = ('book',)
+    only = ('due_back', 'status', 'borrower', 'book__title')
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        return (super().get_queryset().filter(borrower=self.request.user).filter(status__exact='o')
+                .with_overdue().order_by('due_back'))
 
 
-class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllListView(PermissionRequiredMixin, CursorPaginationMixin, QuerysetShapeMixin, generic.ListView):
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/dashboard_staff.html'
     paginate_by = 5
+    cursor_pagination = True
+    select_related = ('book',)
+    only = ('due_back', 'status', 'borrower', 'book__title', 'book__author')
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        queryset = super().get_queryset().filter(status__exact='o')
+        # Overdue copies come first in due_back order, so ?overdue=1 is the
+        # leading slice of the same index range.
+        if self.request.GET.get('overdue'):
+            queryset = queryset.overdue()
+        return queryset.with_overdue().order_by('due_back')
 
 
 @permission_required('catalog.can_mark_returned')
@@ -203,7 +380,7 @@ def renew_book_librarian(request, pk):
         form = RenewBookModelForm(request.POST)
         if form.is_valid():
             book_instance.due_back = form.cleaned_data['due_back']
-            book_instance.save()
+            book_instance.save(update_fields=['due_back'])
             return HttpResponseRedirect(reverse('dashboard_staff'))
 
     else:
@@ -217,10 +394,59 @@ def renew_book_librarian(request, pk):
 
     return render(request, 'catalog/book_renew_librarian.html', context)
 
+@permission_required('catalog.can_mark_returned')
+def export_catalog(request, kind, fmt):
+    if kind not in exporter.EXPORTS or fmt not in exporter.FORMATS:
+        raise Http404('No such export.')
+    compress = bool(request.GET.get('gzip'))
+    response = StreamingHttpResponse(exporter.export(kind, fmt, compress),
+                                     content_type='application/gzip' if compress else exporter.FORMATS[fmt])
+    response['Content-Disposition'] = 'attachment; filename="%s"' % exporter.filename(kind, fmt, compress)
+    return response
+
+
+@permission_required('catalog.can_mark_returned')
+def bulk_copies(request, action):
+    """
+        Apply a ``catalog.bulk`` transition to the copies listed one id per line
+        in the request body, or to those matching the ``filter`` parameter, and
+        report the result for every copy as JSON.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Use POST.'}, status=405)
+    params = request.GET
+    borrower = None
+    if params.get('borrower'):
+        borrower = User.objects.filter(username=params['borrower']).first()
+        if borrower is None:
+            return JsonResponse({'error': 'No user %r.' % params['borrower']}, status=400)
+    try:
+        due_back = datetime.datetime.strptime(params['due_back'], '%Y-%m-%d').date() if params.get('due_back') else None
+    except ValueError:
+        return JsonResponse({'error': 'due_back must be a YYYY-MM-DD date.'}, status=400)
+    # The ids are read from the body line by line, so tens of thousands of
+    # them do not run into DATA_UPLOAD_MAX_MEMORY_SIZE.
+    ids = None if 'filter' in params else (line.decode(errors='replace') for line in request)
+    try:
+        results = bulk.apply(action, ids=ids, where=params.get('filter'), borrower=borrower, due_back=due_back)
+    except bulk.BulkError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    report = [{'id': value, 'result': result, 'status': status} for value, result, status in results]
+    summary = {}
+    for item in report:
+        summary[item['result']] = summary.get(item['result'], 0) + 1
+    return JsonResponse({'action': action, 'summary': summary, 'results': report})
+
+
+@login_required
 def return_book(request, pk):
     book_instance = get_object_or_404(BookInstance, pk=pk)
-    book_instance.status = STATUS_AVAILABLE
-    book_instance.save()
+    # Staff can check in any copy, patrons only their own.
+    borrower = None if request.user.has_perm('catalog.can_mark_returned') else request.user
+    try:
+        loans.return_copy(book_instance.pk, borrower=borrower)
+    except loans.LoanConflict:
+        return loan_conflict(request, book_instance.book_id, 'This copy is not on loan to you.')
     return HttpResponseRedirect(reverse('dashboard_customer'))
 
 
@@ -266,17 +492,15 @@ class BookDelete(PermissionRequiredMixin, DeleteView):
 
 class BookSearchListView(BookListView):
     paginate_by = 3
+    # Results are ordered by relevance, which has no keyset to seek on.
+    cursor_pagination = False
 
     def get_queryset(self):
         result = super(BookSearchListView, self).get_queryset()
 
         query = self.request.GET.get('q')
         if query:
-            query_list = query.split()
-            result = result.filter(
-                reduce(operator.and_,
-                       (Q(title__icontains=q) for q in query_list))
-            )
+            result = search.ranked_queryset(result, query)
 
         return result
 